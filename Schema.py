@@ -69,6 +69,158 @@ schema = {
                 'type': {'required': True, 'type': 'string'}
             }
         }
+    },
+    'relation': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer', 'coerce': int},
+            'version': {'required': True, 'type': 'string'},
+            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
+            'timestamp': {'required': True, 'type': 'string'}
+        }
+    },
+    'relation_members': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'member_type': {'required': True, 'type': 'string', 'allowed': ['node', 'way', 'relation']},
+                'member_id': {'required': True, 'type': 'integer', 'coerce': int},
+                'role': {'required': True, 'type': 'string'},
+                'position': {'required': True, 'type': 'integer', 'coerce': int}
+            }
+        }
+    },
+    'relation_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
     }
 }
 
+
+# SQLite tables built from the shaped elements, in load order.  Columns are
+# taken from the element's schema above, in the same order as the CSV fields.
+
+tables = [
+    {
+        'name': 'nodes',
+        'element': 'node',
+        'csv': 'nodes.csv',
+        'create': '''
+CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY NOT NULL,
+    lat REAL,
+    lon REAL,
+    user TEXT,
+    uid INTEGER,
+    version INTEGER,
+    changeset INTEGER,
+    timestamp TEXT
+)'''
+    },
+    {
+        'name': 'nodes_tags',
+        'element': 'node_tags',
+        'csv': 'nodes_tags.csv',
+        'create': '''
+CREATE TABLE nodes_tags (
+    id INTEGER,
+    key TEXT,
+    value TEXT,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES nodes(id)
+)'''
+    },
+    {
+        'name': 'ways',
+        'element': 'way',
+        'csv': 'ways.csv',
+        'create': '''
+CREATE TABLE ways (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user TEXT,
+    uid INTEGER,
+    version TEXT,
+    changeset INTEGER,
+    timestamp TEXT
+)'''
+    },
+    {
+        'name': 'ways_tags',
+        'element': 'way_tags',
+        'csv': 'ways_tags.csv',
+        'create': '''
+CREATE TABLE ways_tags (
+    id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES ways(id)
+)'''
+    },
+    {
+        'name': 'ways_nodes',
+        'element': 'way_nodes',
+        'csv': 'ways_nodes.csv',
+        'create': '''
+CREATE TABLE ways_nodes (
+    id INTEGER NOT NULL,
+    node_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES ways(id),
+    FOREIGN KEY (node_id) REFERENCES nodes(id)
+)'''
+    },
+    {
+        'name': 'relations',
+        'element': 'relation',
+        'csv': 'relations.csv',
+        'create': '''
+CREATE TABLE relations (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user TEXT,
+    uid INTEGER,
+    version TEXT,
+    changeset INTEGER,
+    timestamp TEXT
+)'''
+    },
+    {
+        'name': 'relations_tags',
+        'element': 'relation_tags',
+        'csv': 'relations_tags.csv',
+        'create': '''
+CREATE TABLE relations_tags (
+    id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    type TEXT,
+    FOREIGN KEY (id) REFERENCES relations(id)
+)'''
+    },
+    {
+        'name': 'relations_members',
+        'element': 'relation_members',
+        'csv': 'relations_members.csv',
+        'create': '''
+CREATE TABLE relations_members (
+    id INTEGER NOT NULL,
+    member_type TEXT NOT NULL,
+    member_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES relations(id)
+)'''
+    }
+]
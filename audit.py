@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Audits for the Chicago OpenStreetMap extract.
+
+ Every audit from the notebook is registered on an AuditEngine as a visitor
+ for the elements it cares about (element type and/or tag key).  The engine
+ parses the OSM file once and fans each element out to all registered
+ visitors, so running every audit costs a single pass over the file.
+ '''
+
+import os
+import pprint
+import re
+import time
+from collections import defaultdict
+from functools import partial
+
+from cleaning import RULES, Cleaner, mapping
+from stream import iter_elements
+
+OSM_FILE = "chicago.osm"
+
+
+# ### Audit engine
+
+class AuditEngine(object):
+    """Run any number of audits in one streaming pass over an OSM file"""
+
+    def __init__(self):
+        self._by_tag = defaultdict(list)
+        self._by_key = defaultdict(list)
+        self._every = []
+
+    def register(self, visitor, tags=None, keys=None, parents=None):
+        """Register visitor(elem) for elements matching tags, tag keys and parents
+
+        tags: element types to visit ('node', 'tag', ...), None for every element
+        keys: 'k' attributes of <tag> elements to visit (implies tags=('tag',))
+        parents: only visit elements whose top level element is one of these
+        """
+        entry = (visitor, parents)
+        if keys is not None:
+            for key in keys:
+                self._by_key[key].append(entry)
+        elif tags is not None:
+            for tag in tags:
+                self._by_tag[tag].append(entry)
+        else:
+            self._every.append(entry)
+        return visitor
+
+    def _dispatch(self, entries, elem, parent):
+        for visitor, parents in entries:
+            if parents is None or parent in parents:
+                visitor(elem)
+
+    def run(self, osm_file, metrics=None):
+        """Parse osm_file once and hand every element to its visitors
+
+        Elements are streamed with iter_elements(), so memory stays flat no
+        matter how large osm_file is.  Visitors must copy what they need out
+        of an element; it is cleared once its top level element is done.
+        A metrics.Metrics times the parse and the visitors ('audit') apart.
+        """
+        elements = iter_elements(osm_file)
+        timing = metrics is not None
+        if timing:
+            clock = time.perf_counter
+            elements = metrics.timed_iter('parse', elements)
+            visiting = metrics.stage('audit')
+            if isinstance(osm_file, str):
+                metrics.stage('parse').bytes_read += os.path.getsize(osm_file)
+
+        for elem, parent in elements:
+            if timing:
+                start = clock()
+            self._dispatch(self._every, elem, parent)
+            self._dispatch(self._by_tag.get(elem.tag, ()), elem, parent)
+            if elem.tag == 'tag' and self._by_key:
+                self._dispatch(self._by_key.get(elem.attrib.get('k'), ()), elem, parent)
+            if timing:
+                visiting.seconds += clock() - start
+                visiting.count += 1
+
+
+# ### Count of nodes and ways
+
+def visit_tag_count(tag_count, elem):
+    tag_count[elem.tag] += 1
+
+
+def register_count_tags(engine):
+    tag_count = defaultdict(int)
+    engine.register(partial(visit_tag_count, tag_count))
+    return tag_count
+
+
+def count_tags(filename):
+    """Count top level tags"""
+    engine = AuditEngine()
+    tag_count = register_count_tags(engine)
+    engine.run(filename)
+    return dict(tag_count)
+
+
+# ### K attribute formatting scheme audit
+
+lower = re.compile(r'^([a-z]|_)*$')
+lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
+problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+
+
+def key_type(element, keys):
+    """Element keys with all lowercase letters: add to 'lower'
+    Element keys with lowercase letters and colon: add to 'lower_colon'
+    Element keys with problem characters: add to 'problemchars'
+    """
+    if element.tag == "tag":
+
+        if lower.search(element.attrib['k']):
+            keys['lower'] += 1
+
+        elif lower_colon.search(element.attrib['k']):
+            keys['lower_colon'] += 1
+        elif problemchars.search(element.attrib['k']):
+            print(element.attrib['k'])
+            keys['problemchars'] += 1
+
+        else:
+            keys['other'] += 1
+
+    return keys
+
+
+def register_key_type(engine):
+    keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
+    engine.register(lambda elem: key_type(elem, keys), tags=('tag',))
+    return keys
+
+
+def audit_keys(filename):
+    """K attribute formatting scheme buckets (process_map in the notebook)"""
+    engine = AuditEngine()
+    keys = register_key_type(engine)
+    engine.run(filename)
+    return keys
+
+
+# ### Audit street types
+
+street_type_re = re.compile(r'\S+\.?$', re.IGNORECASE)
+
+expected = ["Street", "Avenue", "Boulevard", "Drive", "Court", "Place", "Square", "Lane", "Road", "Park", "Access", "Market",
+            "Trail", "Parkway", "Commons", "Way", "Circle", "Trace", "Plaza", "Terrace", "Walk", "Riverwalk", "voltage=138000",
+            "West", "South"]
+
+
+def count_street_type(street_types, street_name):
+    """Count every street type found in the data"""
+    st = street_type_re.search(street_name)
+    if st:
+        street_type = st.group()
+
+        street_types[street_type] += 1
+
+
+def audit_street_type(street_types, street_name):
+    """Check street type in data against expected types"""
+    m = street_type_re.search(street_name)
+    if m:
+        street_type = m.group()
+        if street_type not in expected:
+            street_types[street_type].add(street_name)
+
+
+def print_sorted_dict(d):
+    keys = d.keys()
+    keys = sorted(keys, key=lambda s: s.lower())
+    for k in keys:
+        v = d[k]
+        print("%s: %d" % (k, v))
+
+
+def is_street_name(elem):
+    return (elem.tag == "tag") and (elem.attrib['k'] == "addr:street")
+
+
+def register_street_type_counts(engine):
+    street_types = defaultdict(int)
+    engine.register(lambda elem: count_street_type(street_types, elem.attrib['v']),
+                    keys=('addr:street',))
+    return street_types
+
+
+def register_audit_street(engine):
+    street_types = defaultdict(set)
+    engine.register(lambda elem: audit_street_type(street_types, elem.attrib['v']),
+                    keys=('addr:street',), parents=('node', 'way'))
+    return street_types
+
+
+def audit(osmfile=OSM_FILE):
+    """Count and print every street type"""
+    engine = AuditEngine()
+    street_types = register_street_type_counts(engine)
+    engine.run(osmfile)
+    print_sorted_dict(street_types)
+    return street_types
+
+
+def audit_street(osmfile):
+    """Unexpected street types of nodes and ways with the street names using them"""
+    engine = AuditEngine()
+    street_types = register_audit_street(engine)
+    engine.run(osmfile)
+    return street_types
+
+
+# ### Phone Numbers
+
+phone_re = re.compile(r'\+1[\s-]\d{3}[\s-]\d{3}[\s-]\d{4}$')
+
+
+def is_phone_number(elem):
+    return (elem.tag == "tag") and (elem.attrib['k'] == "contact:phone")
+
+
+def find_phone_numbers(phone_number):
+    """Find phone numbers that need fixing"""
+    m = phone_re.search(phone_number)
+    if not m:
+        return phone_number
+
+
+def visit_phone(num_list, elem):
+    contact_num = find_phone_numbers(elem.attrib['v'])
+    if contact_num is not None:
+        num_list.append(contact_num)
+
+
+def register_audit_phone(engine):
+    num_list = []
+    engine.register(partial(visit_phone, num_list), keys=('contact:phone',))
+    return num_list
+
+
+def audit_phone(file_name):
+    engine = AuditEngine()
+    num_list = register_audit_phone(engine)
+    engine.run(file_name)
+    return num_list
+
+
+# ### Postal Codes
+
+#regular expression for postal codes
+postal_code_re = re.compile(r'^[6][0]\d{3}$')
+
+
+def is_postal_code(elem):
+    return (elem.tag == "tag") and (elem.attrib['k'] == "addr:postcode")
+
+
+def count_postal_code(postal_codes, postal_code):
+    """Count number of each unconventional postal code"""
+    m = postal_code_re.search(postal_code)
+    if not m:
+        postal_codes[postal_code] += 1
+
+
+def register_audit_zip(engine):
+    postal_codes = defaultdict(int)
+    engine.register(lambda elem: count_postal_code(postal_codes, elem.attrib['v']),
+                    keys=('addr:postcode',))
+    return postal_codes
+
+
+def audit_zip(file_name):
+    engine = AuditEngine()
+    postal_codes = register_audit_zip(engine)
+    engine.run(file_name)
+    return postal_codes
+
+
+# ### Every audit in one pass
+
+def audit_all(file_name, metrics=None):
+    """Run every audit above with a single parse of file_name"""
+    engine = AuditEngine()
+    results = {
+        'tags': register_count_tags(engine),
+        'keys': register_key_type(engine),
+        'street_type_counts': register_street_type_counts(engine),
+        'street_types': register_audit_street(engine),
+        'phones': register_audit_phone(engine),
+        'postcodes': register_audit_zip(engine),
+    }
+    engine.run(file_name, metrics)
+    results['tags'] = dict(results['tags'])
+    return results
+
+
+# ### Showing the fixes (cleaning.RULES does the cleaning when shaping)
+
+audit_cleaner = Cleaner(RULES)
+
+
+def update_type(name, mapping):
+    """Replace the abbreviated street type (street_type_re) with its full version using mapping"""
+    m = street_type_re.search(name)
+    if m and m.group() in mapping:
+        return name[:m.start()] + mapping[m.group()]
+    return name
+
+
+def change_name(st_types):
+    """iterate through street types and use helper function update_name to update data"""
+    for st_type, ways in st_types.items():
+            for name in ways:
+                better_name = update_type(name, mapping)
+                print(name, "=>", better_name)
+
+
+def update_number(num):
+    """Run the PHONE_RULES chain on a phone number, normalizing it to E.164"""
+    return audit_cleaner.clean('contact:phone', num)
+
+
+def change_numbers(num_list):
+    for num in num_list:
+        print(num, "=>", update_number(num))
+
+
+def change_zip(zip_code):
+    """Isolate first 5 digits in value attribute"""
+    return audit_cleaner.clean('addr:postcode', zip_code)
+
+
+def update_postal_codes(fix_pc):
+    for zip_code in fix_pc.keys():
+        print(zip_code, "=>", change_zip(zip_code))
+
+
+if __name__ == '__main__':
+    pprint.pprint(audit_all(OSM_FILE))
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Reproducible benchmark of the wrangling pipeline on synthetic OSM data.
+
+ generate_osm() writes an OSM XML file of any size from a seed: nodes in
+ small clusters inside the Chicago bounding box, ways over consecutive
+ nodes, users with a long-tailed edit distribution, and tags drawn from
+ NODE_TAGS / WAY_TAGS, lists of (key, probability, values) that include the
+ dirty street, phone and postcode values the audits look for.
+
+ run_benchmark() generates a file in a scratch directory and times every
+ stage on it: the audits, get_element() parsing, shape_element(),
+ validation, CSV writing (data.process_map() with metrics), the SQLite
+ loads (load_csv() and load_osm()) and every notebook query.  The results,
+ with the commit, Python and SQLite versions and the generator settings, are
+ written as JSON; compare() reports the stages whose throughput dropped
+ against an earlier result file.
+
+   python benchmark.py --nodes 200000 --ways 20000 --out bench.json --baseline old.json
+
+ --tags reads another tag distribution from a JSON file, with either or
+ both of NODE_TAGS / WAY_TAGS as lists of [key, probability, [values]]:
+
+   {"node_tags": [["amenity", 0.5, ["cafe", "bank"]]], "way_tags": []}
+ '''
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import quoteattr
+
+import audit
+import data
+import database
+from metrics import Metrics
+from queries import QUERIES
+from stream import get_element
+
+BENCHMARK_PATH = 'benchmark.json'
+
+CHICAGO_BBOX = (41.64, -87.94, 42.02, -87.52)  # min lat, min lon, max lat, max lon
+
+# (key, probability per element, values); values are drawn uniformly
+NODE_TAGS = [
+    ('amenity', 0.08, ['restaurant', 'cafe', 'bank', 'school', 'place_of_worship', 'pharmacy', 'fast_food']),
+    ('cuisine', 0.03, ['pizza', 'mexican', 'chinese', 'american', 'italian', 'thai', 'coffee_shop']),
+    ('religion', 0.01, ['christian', 'muslim', 'jewish']),
+    ('name', 0.10, ['Jewel-Osco', 'Starbucks', 'Chicago Public Library', 'Art Institute of Chicago',
+                    'Field Museum', 'Walgreens']),
+    ('addr:street', 0.05, ['N Clark St', 'West Madison Ave', 'S State Street', 'Sangamon',
+                           'E Randolph Street', 'North Michigan Avenue']),
+    ('addr:postcode', 0.04, ['60601', '60614', 'IL 60657', '60622-1234', '60302']),
+    ('phone', 0.02, ['+1-312-372-0072', '(312) 920-9100', '888-642-6674', '+13122650580',
+                     '+1 (312) 475-1390', '7732482570', '312/555/0100', '800 DL MOODY']),
+    ('website', 0.02, ['http://www.example.com', 'https://www.chicago.gov']),
+    ('highway', 0.05, ['traffic_signals', 'crossing', 'bus_stop', 'stop']),
+]
+
+WAY_TAGS = [
+    ('highway', 0.5, ['residential', 'service', 'footway', 'primary', 'secondary']),
+    ('building', 0.4, ['yes', 'house', 'apartments', 'commercial']),
+    ('name', 0.3, ['West Madison Street', 'North Clark Street', 'Lake Shore Drive']),
+    ('addr:street', 0.1, ['N Clark St', 'W Madison Ave', 'S Halsted Street']),
+    ('amenity', 0.05, ['parking', 'school', 'place_of_worship']),
+    ('religion', 0.02, ['christian']),
+    ('denomination', 0.02, ['catholic', 'baptist', 'lutheran', 'methodist']),
+]
+
+
+def _tags(rng, distribution):
+    return [(key, rng.choice(values)) for key, probability, values in distribution
+            if rng.random() < probability]
+
+
+def _write_tags(f, tags):
+    for key, value in tags:
+        f.write('  <tag k=%s v=%s/>\n' % (quoteattr(key), quoteattr(value)))
+
+
+def generate_osm(path, nodes=100000, ways=10000, nodes_per_way=8, users=500,
+                 node_tags=NODE_TAGS, way_tags=WAY_TAGS, seed=0):
+    """Write a synthetic OSM XML file; returns its size in bytes
+
+    Way n uses nodes n*nodes_per_way+1 ... (n+1)*nodes_per_way, which lie in
+    one small cluster, so way bounding boxes stay small; the nodes beyond
+    ways * nodes_per_way are free-standing points.
+    """
+    rng = random.Random(seed)
+    min_lat, min_lon, max_lat, max_lon = CHICAGO_BBOX
+    user_weights = [1.0 / rank for rank in range(1, users + 1)]
+    user_ids = list(range(1, users + 1))
+    ways = min(ways, nodes // nodes_per_way)
+
+    def attributes(element_id):
+        uid = rng.choices(user_ids, user_weights)[0]
+        return 'id="%d" version="%d" changeset="%d" timestamp="2017-%02d-%02dT12:00:00Z" uid="%d" user=%s' % (
+            element_id, rng.randint(1, 9), rng.randint(1000000, 50000000), rng.randint(1, 12),
+            rng.randint(1, 28), uid, quoteattr('user_%d' % uid))
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="benchmark.py">\n')
+        f.write(' <bounds minlat="%s" minlon="%s" maxlat="%s" maxlon="%s"/>\n' % CHICAGO_BBOX)
+        lat = lon = None
+        for node_id in range(1, nodes + 1):
+            if (node_id - 1) % nodes_per_way == 0:
+                lat, lon = rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+            tags = _tags(rng, node_tags)
+            f.write(' <node %s lat="%.7f" lon="%.7f"' % (
+                attributes(node_id), lat + rng.uniform(-0.001, 0.001), lon + rng.uniform(-0.001, 0.001)))
+            if tags:
+                f.write('>\n')
+                _write_tags(f, tags)
+                f.write(' </node>\n')
+            else:
+                f.write('/>\n')
+
+        for n in range(ways):
+            f.write(' <way %s>\n' % attributes(n + 1))
+            for node_id in range(n * nodes_per_way + 1, (n + 1) * nodes_per_way + 1):
+                f.write('  <nd ref="%d"/>\n' % node_id)
+            _write_tags(f, _tags(rng, way_tags))
+            f.write(' </way>\n')
+        f.write('</osm>\n')
+    return os.path.getsize(path)
+
+
+def distribution(tags):
+    """A tag distribution as JSON-ready [key, probability, [values]] lists"""
+    return [[key, probability, list(values)] for key, probability, values in tags]
+
+
+def read_tags(path):
+    """(node_tags, way_tags) from a JSON file; a missing entry keeps the default"""
+    with open(path, 'r', encoding='utf-8') as f:
+        tags = json.load(f)
+    unknown = set(tags) - {'node_tags', 'way_tags'}
+    if unknown:
+        raise ValueError("unknown tag distributions in %s: %s" % (path, ', '.join(sorted(unknown))))
+    return distribution(tags.get('node_tags', NODE_TAGS)), distribution(tags.get('way_tags', WAY_TAGS))
+
+
+def _stage(seconds, count=0):
+    return {'seconds': seconds, 'elements': count, 'elements_per_sec': count / seconds if seconds else None}
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(nodes=100000, ways=10000, nodes_per_way=8, users=500, seed=0, repeat=3,
+                  out=BENCHMARK_PATH, workdir=None, node_tags=NODE_TAGS, way_tags=WAY_TAGS):
+    """Generate a synthetic extract, time every stage on it and write the results to out"""
+    out = os.path.abspath(out) if out else None
+    scratch = workdir or tempfile.mkdtemp(prefix='osm-benchmark-')
+    cwd = os.getcwd()
+    os.chdir(scratch)
+    try:
+        osm_path = 'benchmark.osm'
+        db_path = 'benchmark.db'
+        file_bytes, generate_seconds = _timed(generate_osm, osm_path, nodes, ways, nodes_per_way, users,
+                                              node_tags, way_tags, seed)
+        stages = {'generate': _stage(generate_seconds)}
+
+        audit_metrics = Metrics()
+        audit.audit_all(osm_path, audit_metrics)
+        report = audit_metrics.as_dict()['stages']
+        stages['audit_parse'] = report['parse']
+        stages['audit'] = report['audit']
+
+        start = time.perf_counter()
+        count = sum(1 for _ in get_element(osm_path, tags=('node', 'way')))
+        stages['get_element'] = _stage(time.perf_counter() - start, count)
+
+        map_metrics = Metrics()
+        data.process_map(osm_path, True, metrics=map_metrics)
+        for name, stage in map_metrics.as_dict()['stages'].items():
+            stages['process_map_' + name] = stage
+
+        (csv_stats, seconds) = _timed(database.load_csv, db_path)
+        stages['load_csv'] = _stage(seconds, sum(rows for rows, _ in csv_stats.values()))
+
+        os.remove(db_path)
+        load_metrics = Metrics()
+        database.load_osm(osm_path, db_path, metrics=load_metrics)
+        for name, stage in load_metrics.as_dict()['stages'].items():
+            stages['load_osm_' + name] = stage
+
+        conn = sqlite3.connect(db_path)
+        try:
+            query_seconds = database.time_queries(conn, QUERIES, repeat)
+        finally:
+            conn.close()
+
+        results = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'settings': {'nodes': nodes, 'ways': ways, 'nodes_per_way': nodes_per_way, 'users': users,
+                         'seed': seed, 'repeat': repeat, 'node_tags': distribution(node_tags),
+                         'way_tags': distribution(way_tags)},
+            'file_bytes': file_bytes,
+            'db_bytes': os.path.getsize(db_path),
+            'stages': stages,
+            'queries': query_seconds,
+        }
+    finally:
+        os.chdir(cwd)
+        if workdir is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    if out:
+        with open(out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def compare(baseline, current, threshold=0.10, min_seconds=0.005):
+    """Print and return the stages and queries more than threshold slower than baseline
+
+    baseline and current are results dicts or paths to result files.  Stages
+    are compared by elements/sec (or seconds when they count no elements),
+    queries by seconds; differences under min_seconds are timer noise and
+    never count.
+    """
+    def load(results):
+        if isinstance(results, str):
+            with open(results, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return results
+
+    baseline, current = load(baseline), load(current)
+    old_settings, new_settings = baseline.get('settings') or {}, current.get('settings') or {}
+    differ = sorted(key for key in set(old_settings) | set(new_settings)
+                    if old_settings.get(key) != new_settings.get(key))
+    if differ:
+        # sizes or tag distributions (node_tags, way_tags) differ: the throughputs are not comparable
+        print("warning: benchmark settings differ: %s" % ', '.join(
+            key if key.endswith('_tags') else '%s %s vs %s' % (key, old_settings.get(key), new_settings.get(key))
+            for key in differ))
+
+    regressions = []
+    for name, stage in current['stages'].items():
+        old = baseline['stages'].get(name)
+        if old is None or abs(stage['seconds'] - old['seconds']) < min_seconds:
+            continue
+        if stage['elements_per_sec'] and old['elements_per_sec']:
+            change = old['elements_per_sec'] / stage['elements_per_sec'] - 1
+        elif old['seconds']:
+            change = stage['seconds'] / old['seconds'] - 1
+        else:
+            continue
+        if change > threshold:
+            regressions.append((name, change))
+    for name, seconds in current['queries'].items():
+        old = baseline['queries'].get(name)
+        if old and seconds - old >= min_seconds and seconds / old - 1 > threshold:
+            regressions.append(('query ' + name, seconds / old - 1))
+
+    for name, change in regressions:
+        print("%s: %.0f%% slower" % (name, change * 100))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--ways', type=int, default=10000)
+    parser.add_argument('--nodes-per-way', type=int, default=8)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tags', help='JSON file with node_tags / way_tags distributions')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per query (best is kept)')
+    parser.add_argument('--out', default=BENCHMARK_PATH)
+    parser.add_argument('--baseline', help='earlier result file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='slowdown that counts as a regression')
+    args = parser.parse_args(argv)
+
+    node_tags, way_tags = read_tags(args.tags) if args.tags else (NODE_TAGS, WAY_TAGS)
+    results = run_benchmark(args.nodes, args.ways, args.nodes_per_way, args.users, args.seed,
+                            args.repeat, args.out, node_tags=node_tags, way_tags=way_tags)
+    for name, stage in results['stages'].items():
+        print("%-28s %8.2fs %s" % (name, stage['seconds'], "%10d elements/sec" % stage['elements_per_sec']
+                                    if stage['elements_per_sec'] else ''))
+    for name, seconds in results['queries'].items():
+        print("%-28s %8.2fms" % ('query ' + name, seconds * 1000))
+    if args.baseline:
+        return 1 if compare(args.baseline, results, args.threshold) else 0  # non-zero fails a CI job
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
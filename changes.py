@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Apply OpenStreetMap change files (.osc, or compressed .osc.gz / .osc.bz2)
+ to chicago.db.
+
+ A change file lists created, modified and deleted elements:
+
+   <osmChange version="0.6">
+     <create> <node .../> <way>...</way> </create>
+     <modify> ... </modify>
+     <delete> <node id="..."/> ... </delete>
+   </osmChange>
+
+ Created and modified nodes, ways and relations go through the same
+ shape_element() cleaning as the full load; their row in nodes/ways/relations
+ is replaced and their tags (and way nodes or members) are deleted and
+ re-inserted, so ways_nodes.position and relations_members.position always
+ match the current <nd> / <member> order.  Deleted elements lose their rows
+ in every table, all_tags included.  Only the rows of the elements in the diff are touched, so
+ the cost follows the size of the diff rather than the size of the city.
+ The stored summary (summary.Summary) is adjusted the same way: the stored
+ version of every changed element is counted out and the new one counted in.
+ The spatial indexes are refreshed for the changed nodes and for the ways
+ that were changed or use a changed node.
+ '''
+
+import sqlite3
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+from data import shape_element, validate_element, new_validator
+from database import DB_PATH, TABLES, WAYS_RTREE_INSERT, element_rows, insert_statement
+from stream import file_format, open_osm
+from summary import Summary, stored_element
+
+ACTIONS = ('create', 'modify', 'delete')
+
+ALL_TAGS_INSERT = 'INSERT INTO all_tags (element_type, id, key, value, type) VALUES (?, ?, ?, ?, ?);'
+
+# element type -> (main table, [(child table, shaped element key)])
+ELEMENT_TABLES = {
+    'node': ('nodes', [('nodes_tags', 'node_tags')]),
+    'way': ('ways', [('ways_tags', 'way_tags'), ('ways_nodes', 'way_nodes')]),
+    'relation': ('relations', [('relations_tags', 'relation_tags'), ('relations_members', 'relation_members')]),
+}
+
+
+def iter_changes(osc_file):
+    """Yield (action, element) for every element of a change file
+
+    The action block is cleared after each element, so memory stays flat
+    however many elements a block holds.  Compressed files are decompressed
+    on the fly (stream.open_osm()).
+    """
+    if file_format(osc_file) == 'xml':
+        yield from _iter_changes(osc_file)
+        return
+    source = open_osm(osc_file)
+    try:
+        yield from _iter_changes(source)
+    finally:
+        source.close()
+
+
+def _iter_changes(osc_file):
+    context = ET.iterparse(osc_file, events=('start', 'end'))
+    _, root = next(context)
+    depth = 1
+    action = None
+    block = None
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            if depth == 2:
+                action, block = elem.tag, elem
+            continue
+
+        depth -= 1
+        if depth == 2 and action in ACTIONS:
+            yield action, elem
+            block.clear()
+        elif depth == 1:
+            root.clear()
+
+
+# shaped tag key -> element type of its all_tags rows
+ALL_TAGS_TYPES = {'node_tags': 'node', 'way_tags': 'way', 'relation_tags': 'relation'}
+
+
+def delete_children(cur, element_type, element_id):
+    """Delete the tags (and way nodes or members) of an element, all_tags included"""
+    _, children = ELEMENT_TABLES[element_type]
+    for child, _ in children:
+        cur.execute('DELETE FROM {0} WHERE id = ?'.format(child), (element_id,))
+    cur.execute('DELETE FROM all_tags WHERE element_type = ? AND id = ?', (element_type, element_id))
+
+
+def delete_element(cur, element_type, element_id):
+    table, _ = ELEMENT_TABLES[element_type]
+    delete_children(cur, element_type, element_id)
+    cur.execute('DELETE FROM {0} WHERE id = ?'.format(table), (element_id,))
+
+
+def update_spatial(cur, node_ids, way_ids):
+    """Refresh nodes_rtree and ways_rtree for changed nodes and ways, if the database has them"""
+    if cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'nodes_rtree'").fetchone() is None:
+        return
+    for node_id in node_ids:
+        cur.execute('DELETE FROM nodes_rtree WHERE id = ?', (node_id,))
+        cur.execute('INSERT INTO nodes_rtree (id, min_lat, max_lat, min_lon, max_lon) '
+                    'SELECT id, lat, lat, lon, lon FROM nodes '
+                    'WHERE id = ? AND lat IS NOT NULL AND lon IS NOT NULL', (node_id,))
+
+    way_ids = set(way_ids)
+    for node_id in node_ids:
+        way_ids.update(row[0] for row in cur.execute(
+            'SELECT DISTINCT id FROM ways_nodes WHERE node_id = ?', (node_id,)))
+    for way_id in way_ids:
+        cur.execute('DELETE FROM ways_rtree WHERE id = ?', (way_id,))
+        cur.execute(WAYS_RTREE_INSERT.format('WHERE ways_nodes.id = ?'), (way_id,))
+
+
+def apply_changes(osc_file, db_path=DB_PATH, validate=False):
+    """Apply a change file to db_path in one transaction; return counts per (action, type)"""
+    statements = {key: insert_statement(table, columns) for table, key, _, columns, _ in TABLES}
+    for key in ELEMENT_TABLES:
+        statements[key] = statements[key].replace('INSERT', 'INSERT OR REPLACE', 1)
+    validator = new_validator() if validate is True else None
+    counts = Counter()
+    changed = {element_type: set() for element_type in ELEMENT_TABLES}
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    cur = conn.cursor()
+    cur.execute('BEGIN')
+    try:
+        summary = Summary.load(cur)
+        for action, element in iter_changes(osc_file):
+            if element.tag not in ELEMENT_TABLES:
+                continue
+            counts[(action, element.tag)] += 1
+
+            element_id = element.get('id')
+            changed[element.tag].add(int(element_id))
+            if summary is not None:
+                old = stored_element(cur, element.tag, element_id)
+                if old is not None:
+                    summary.add(old, sign=-1)
+            if action == 'delete':
+                delete_element(cur, element.tag, element_id)
+                continue
+
+            el = shape_element(element)
+            if validator is not None:
+                validate_element(el, validator)
+            if summary is not None:
+                summary.add(el)
+
+            delete_children(cur, element.tag, element_id)
+            for key, rows in element_rows(el):
+                cur.executemany(statements[key], rows)
+                if key in ALL_TAGS_TYPES:
+                    cur.executemany(ALL_TAGS_INSERT, [(ALL_TAGS_TYPES[key],) + row for row in rows])
+        update_spatial(cur, changed['node'], changed['way'])
+        if summary is not None:
+            summary.save(cur)
+        cur.execute('COMMIT')
+    except BaseException:
+        cur.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+    return dict(counts)
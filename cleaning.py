@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Table-driven cleaning of tag values, keyed by tag key.
+
+ RULES declares, for each tag key, the rules applied to its values:
+
+   TokenRule   - replace whole space-separated tokens through a mapping
+                 (optionally only the first or the last token); never
+                 touches substrings
+   SubRule     - regular expression substitution
+   ExtractRule - keep the first match of a regular expression, if any
+   CallRule    - any function of the value (phones.clean_phone)
+
+ Cleaner compiles RULES once: every TokenRule of a key is merged into one
+ dict lookup per token, and every regular expression is compiled up front,
+ so a value is split and scanned a single time whatever the size of the
+ mapping tables.  Each rule counts how often it ran and how many
+ replacements it made; with profile=True it also times itself, and report()
+ prints values/sec per rule.
+
+ Tag values repeat heavily (the same street names, postcodes and phone
+ formats thousands of times), so Cleaner memoizes the cleaned value of each
+ key in a bounded LRU cache of cache_size entries per key.  cache_info()
+ gives the hits, misses and size of every key's cache; the rule counters
+ above then only see the cache misses.
+ '''
+
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache, partial
+
+from phones import clean_phone
+
+CACHE_SIZE = 4096
+
+# street type abbreviations found by the street audit
+mapping = { "Ave": "Avenue",
+            "Sangamon": "Sangamon Street",
+           }
+
+# abbreviated directions at the start of a street name
+d_mapping = { "N": "North",
+              "S": "South",
+              "E": "East",
+              "W": "West",
+             }
+
+
+class TokenRule(object):
+    """Replace whole tokens of a value using mapping
+
+    first_only / last_only restrict the rule to the first or the last token
+    (a street's direction prefix or its type, as audit.street_type_re finds it).
+    """
+
+    def __init__(self, name, mapping, first_only=False, last_only=False):
+        if first_only and last_only:
+            raise ValueError("TokenRule %r: first_only and last_only are exclusive" % name)
+        self.name = name
+        self.mapping = mapping
+        self.first_only = first_only
+        self.last_only = last_only
+
+
+class SubRule(object):
+    """re.sub(pattern, repl, value, count)"""
+
+    def __init__(self, name, pattern, repl, count=0):
+        self.name = name
+        self.pattern = pattern
+        self.repl = repl
+        self.count = count
+
+
+class ExtractRule(object):
+    """Keep group 1 of the first match of pattern, leave the value alone otherwise"""
+
+    def __init__(self, name, pattern):
+        self.name = name
+        self.pattern = pattern
+
+
+class CallRule(object):
+    """Replace the value with function(value)"""
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+
+
+PHONE_RULES = [SubRule('phone_slashes', r'/', '-', count=3),
+               CallRule('phone_e164', clean_phone)]
+
+RULES = {
+    'addr:street': [TokenRule('street_direction', d_mapping, first_only=True),
+                    TokenRule('street_type', mapping, last_only=True)],
+    'contact:phone': PHONE_RULES,
+    'phone': PHONE_RULES,
+    'addr:postcode': [ExtractRule('postcode', r'(60\d{3})')],
+}
+
+
+class RuleStats(object):
+    __slots__ = ('calls', 'hits', 'seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+
+class CompiledRules(object):
+    """The rules of one tag key, compiled into token lookups and regexes"""
+
+    def __init__(self, rules, stats):
+        self.first_tokens = {}
+        self.last_tokens = {}
+        self.tokens = {}
+        self.token_rules = []
+        self.patterns = []
+        for rule in rules:
+            rule_stats = stats.setdefault(rule.name, RuleStats())
+            if isinstance(rule, TokenRule):
+                lookup = (self.first_tokens if rule.first_only else
+                          self.last_tokens if rule.last_only else self.tokens)
+                for token, replacement in rule.mapping.items():
+                    lookup.setdefault(token, (replacement, rule_stats))
+                self.token_rules.append(rule_stats)
+            elif isinstance(rule, SubRule):
+                pattern = re.compile(rule.pattern)
+                self.patterns.append((lambda value, p=pattern, r=rule: p.sub(r.repl, value, r.count), rule_stats))
+            elif isinstance(rule, ExtractRule):
+                pattern = re.compile(rule.pattern)
+                self.patterns.append((lambda value, p=pattern: _extract(p, value), rule_stats))
+            elif isinstance(rule, CallRule):
+                self.patterns.append((rule.function, rule_stats))
+            else:
+                raise TypeError("unknown cleaning rule %r" % (rule,))
+
+
+def _extract(pattern, value):
+    m = pattern.search(value)
+    return m.group(1) if m else value
+
+
+class Cleaner(object):
+    """Apply the compiled RULES of a tag key to its values in one pass"""
+
+    def __init__(self, rules=RULES, profile=False, cache_size=CACHE_SIZE):
+        self.profile = profile
+        self.cache_size = cache_size
+        self.stats = OrderedDict()
+        self.rules = {key: CompiledRules(key_rules, self.stats) for key, key_rules in rules.items()}
+        self.caches = {}
+        if cache_size:
+            self.caches = {key: lru_cache(maxsize=cache_size)(partial(self._apply, compiled))
+                           for key, compiled in self.rules.items()}
+
+    def clean(self, key, value):
+        """Cleaned value for tag key (value unchanged if key has no rules)"""
+        cache = self.caches.get(key)
+        if cache is not None:
+            return cache(value)
+        compiled = self.rules.get(key)
+        if compiled is None:
+            return value
+        return self._apply(compiled, value)
+
+    def cache_info(self):
+        """{key: {'hits', 'misses', 'size', 'maxsize'}} for every key's LRU cache"""
+        info = {}
+        for key, cache in self.caches.items():
+            hits, misses, maxsize, size = cache.cache_info()
+            info[key] = {'hits': hits, 'misses': misses, 'size': size, 'maxsize': maxsize}
+        return info
+
+    def rule_counts(self):
+        """{rule name: {'calls', 'hits', 'seconds'}} snapshot of the rule counters"""
+        return {name: {'calls': s.calls, 'hits': s.hits, 'seconds': s.seconds}
+                for name, s in self.stats.items()}
+
+    def clear_cache(self):
+        for cache in self.caches.values():
+            cache.cache_clear()
+
+    def _apply(self, compiled, value):
+        if self.profile:
+            start = time.perf_counter()
+
+        if compiled.token_rules:
+            value = self._clean_tokens(compiled, value)
+            if self.profile:
+                elapsed = (time.perf_counter() - start) / len(compiled.token_rules)
+                for rule_stats in compiled.token_rules:
+                    rule_stats.seconds += elapsed
+
+        for apply, rule_stats in compiled.patterns:
+            if self.profile:
+                start = time.perf_counter()
+            new_value = apply(value)
+            rule_stats.calls += 1
+            if new_value != value:
+                rule_stats.hits += 1
+                value = new_value
+            if self.profile:
+                rule_stats.seconds += time.perf_counter() - start
+        return value
+
+    def _clean_tokens(self, compiled, value):
+        tokens = value.split(' ')
+        changed = False
+        for rule_stats in compiled.token_rules:
+            rule_stats.calls += 1
+
+        if compiled.first_tokens:
+            hit = compiled.first_tokens.get(tokens[0])
+            if hit is not None:
+                tokens[0] = hit[0]
+                hit[1].hits += 1
+                changed = True
+
+        if compiled.last_tokens:
+            hit = compiled.last_tokens.get(tokens[-1])
+            if hit is not None:
+                tokens[-1] = hit[0]
+                hit[1].hits += 1
+                changed = True
+
+        if compiled.tokens:
+            lookup = compiled.tokens.get
+            for i, token in enumerate(tokens):
+                hit = lookup(token)
+                if hit is not None:
+                    tokens[i] = hit[0]
+                    hit[1].hits += 1
+                    changed = True
+
+        return ' '.join(tokens) if changed else value
+
+    def report(self):
+        """Print calls, hits and (when profiling) values/sec for every rule"""
+        for name, rule_stats in self.stats.items():
+            line = "%s: %d values, %d changed" % (name, rule_stats.calls, rule_stats.hits)
+            if self.profile and rule_stats.seconds:
+                line += ", %d values/sec" % (rule_stats.calls / rule_stats.seconds)
+            print(line)
+        for key, info in self.cache_info().items():
+            lookups = info['hits'] + info['misses']
+            if lookups:
+                print("%s cache: %d hits, %d misses (%.1f%% hit rate), %d/%d entries" % (
+                    key, info['hits'], info['misses'], 100.0 * info['hits'] / lookups,
+                    info['size'], info['maxsize']))
+
+
+cleaner = Cleaner()
+
+
+def clean_value(key, value):
+    """Clean a tag value with the module level Cleaner"""
+    return cleaner.clean(key, value)
+
+
+def cache_delta(before, after):
+    """Cache hits and misses between two cache_info() snapshots, per key"""
+    delta = {}
+    for key, info in after.items():
+        old = before.get(key, {'hits': 0, 'misses': 0})
+        delta[key] = {'hits': info['hits'] - old['hits'], 'misses': info['misses'] - old['misses'],
+                      'size': info['size'], 'maxsize': info['maxsize']}
+    return delta
+
+
+def merge_cache_info(total, info):
+    """Add the hits and misses of info into total (sizes keep the largest)"""
+    for key, counts in info.items():
+        merged = total.setdefault(key, {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': counts['maxsize']})
+        merged['hits'] += counts['hits']
+        merged['misses'] += counts['misses']
+        merged['size'] = max(merged['size'], counts['size'])
+    return total
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Columnar (Parquet) output for the shaped OSM tables.
+
+ ParquetDictWriter has the writerow/writerows interface of the CSV writers
+ used by data.write_elements(), but buffers rows column by column, coerces
+ them to the types declared in Schema.py (integer -> int64, float ->
+ float64, string -> string) and writes one compressed row group every
+ row_group_size rows.  ParquetRecordWriter does the same for the row tuples
+ of data.shape_record().  Readers then get typed columns instead of re-parsing
+ ids and coordinates from text.  Requires pyarrow.
+ '''
+
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from Schema import schema
+
+ROW_GROUP_SIZE = 65536
+COMPRESSION = 'zstd'
+
+
+def parquet_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '.parquet'
+
+
+def element_fields(element):
+    """(field, rules) pairs of a shaped element's schema, in schema order"""
+    spec = schema[element]
+    if spec['type'] == 'list':
+        spec = spec['schema']
+    return list(spec['schema'].items())
+
+
+def arrow_schema(element):
+    types = {'integer': pa.int64(), 'float': pa.float64(), 'string': pa.string()}
+    return pa.schema([pa.field(field, types[rules['type']], nullable=not rules.get('required'))
+                      for field, rules in element_fields(element)])
+
+
+class ParquetDictWriter(object):
+    """Write shaped element rows (dicts) to a Parquet file in typed row groups"""
+
+    def __init__(self, path, element, row_group_size=ROW_GROUP_SIZE, compression=COMPRESSION):
+        if pa is None:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+        self.fields = element_fields(element)
+        self.schema = arrow_schema(element)
+        self.row_group_size = row_group_size
+        self._coerce = [(field, rules.get('coerce')) for field, rules in self.fields]
+        self._columns = [[] for _ in self.fields]
+        self._writer = pq.ParquetWriter(path, self.schema, compression=compression)
+
+    def writerow(self, row):
+        for column, (field, coerce) in zip(self._columns, self._coerce):
+            value = row.get(field)
+            column.append(coerce(value) if coerce is not None and value is not None else value)
+        if len(self._columns[0]) >= self.row_group_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self._columns[0]:
+            batch = pa.RecordBatch.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(self._columns, self.schema)],
+                schema=self.schema)
+            self._writer.write_batch(batch, row_group_size=self.row_group_size)
+            self._columns = [[] for _ in self.fields]
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetRecordWriter(ParquetDictWriter):
+    """Write row tuples, in schema (and CSV field) order, to a Parquet file"""
+
+    def writerow(self, row):
+        for column, (_, coerce), value in zip(self._columns, self._coerce, row):
+            column.append(coerce(value) if coerce is not None and value is not None else value)
+        if len(self._columns[0]) >= self.row_group_size:
+            self.flush()
+
+
+def open_parquet_writers(stack, outputs, row_group_size=ROW_GROUP_SIZE, compression=COMPRESSION):
+    """One ParquetRecordWriter per (shaped element key, csv path, fields) output"""
+    writers = {}
+    for name, csv_path, _ in outputs:
+        writers[name] = stack.enter_context(
+            ParquetRecordWriter(parquet_path(csv_path), name, row_group_size, compression))
+    return writers
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Shared pytest fixtures (python -m pytest from this directory).
+
+ make_osm writes synthetic extracts with benchmark.generate_osm(); workdir
+ runs a test inside its tmp_path, where process_map() writes the CSVs.
+ '''
+
+import pytest
+
+from benchmark import generate_osm
+
+
+@pytest.fixture
+def make_osm(tmp_path):
+    """make_osm(name, **generate_osm settings) -> path of a synthetic extract in tmp_path"""
+    def make(name='sample.osm', **settings):
+        path = str(tmp_path / name)
+        generate_osm(path, **settings)
+        return path
+    return make
+
+
+@pytest.fixture
+def sample_osm(make_osm):
+    """A small synthetic extract: 2000 nodes, 200 ways"""
+    return make_osm(nodes=2000, ways=200)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Dense, memory-mapped store of node coordinates for assembling way geometry.
+
+ data.process_map() feeds every node it shapes to a CoordinateWriter, which
+ appends the id, lat and lon to three raw files; build_store() then lays
+ them out in COORDS_PATH as
+
+   b'OSMCRD01' | count (uint64) | ids (int64[count]) | lat (float64[count]) | lon (float64[count])
+
+ in native byte order, with the ids sorted.  CoordinateStore maps the file
+ without reading it and lookup() turns a way's node_id list (in position
+ order) into a (len, 2) array of (lat, lon) with one vectorized binary
+ search, instead of joining ways_nodes to nodes row by row in SQLite.  numpy
+ is optional: without it lookup() does a bisect per id over the mapped file
+ and returns a list of (lat, lon) tuples.
+ '''
+
+import csv
+import mmap
+import os
+import shutil
+import struct
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COORDS_PATH = 'node_coords.bin'
+
+MAGIC = b'OSMCRD01'
+HEADER = struct.Struct('=8sQ')
+
+BUFFER_SIZE = 65536
+COPY_SIZE = 1 << 20
+
+MISSING = (float('nan'), float('nan'))
+
+
+def raw_paths(path):
+    """The (ids, lat, lon) raw files a CoordinateWriter appends to"""
+    return [path + '.ids', path + '.lat', path + '.lon']
+
+
+class CoordinateWriter(object):
+    """Append node ids and coordinates to the raw files of path"""
+
+    def __init__(self, path):
+        self.path = path
+        self.files = [open(raw_path, 'wb') for raw_path in raw_paths(path)]
+        self.ids = array('q')
+        self.lats = array('d')
+        self.lons = array('d')
+
+    def add(self, node_id, lat, lon):
+        self.ids.append(int(node_id))
+        self.lats.append(float(lat))
+        self.lons.append(float(lon))
+        if len(self.ids) >= BUFFER_SIZE:
+            self.flush()
+
+    def add_node(self, node):
+        """Add a shaped node dict (nodes without coordinates are skipped)"""
+        if node['lat'] is not None and node['lon'] is not None:
+            self.add(node['id'], node['lat'], node['lon'])
+
+    def flush(self):
+        for values, f in zip((self.ids, self.lats, self.lons), self.files):
+            values.tofile(f)
+            del values[:]
+
+    def close(self):
+        self.flush()
+        for f in self.files:
+            f.close()
+
+
+def _id_range(ids_path):
+    """(first, last) id of a raw ids file, or None if its ids are not strictly increasing"""
+    first = last = None
+    with open(ids_path, 'rb') as f:
+        while True:
+            block = array('q')
+            block.frombytes(f.read(COPY_SIZE))
+            if not block:
+                return first, last
+            if np is not None:
+                values = np.frombuffer(block, dtype=np.int64)
+                if (last is not None and values[0] <= last) or np.any(np.diff(values) <= 0):
+                    return None
+            else:
+                previous = last
+                for value in block:
+                    if previous is not None and value <= previous:
+                        return None
+                    previous = value
+            if first is None:
+                first = block[0]
+            last = block[-1]
+
+
+def build_store(shards, path=COORDS_PATH):
+    """Combine CoordinateWriter shards (in file order) into the store at path
+
+    OSM files list nodes by id, so the concatenated ids are normally already
+    sorted and the shards are copied straight through; otherwise the rows
+    are sorted by id.  The raw shard files are removed.  Returns the number
+    of nodes stored.
+    """
+    shard_files = [raw_paths(shard) for shard in shards]
+    count = sum(os.path.getsize(files[0]) for files in shard_files) // 8
+    in_order = True
+    last = None
+    for files in shard_files:
+        id_range = _id_range(files[0])
+        if id_range is None or (id_range[0] is not None and last is not None and id_range[0] <= last):
+            in_order = False
+            break
+        if id_range[1] is not None:
+            last = id_range[1]
+
+    with open(path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, count))
+        if in_order:
+            for column in range(3):
+                for files in shard_files:
+                    with open(files[column], 'rb') as f:
+                        shutil.copyfileobj(f, out, COPY_SIZE)
+        else:
+            columns = []
+            for column, typecode in enumerate('qdd'):
+                values = array(typecode)
+                for files in shard_files:
+                    with open(files[column], 'rb') as f:
+                        values.frombytes(f.read())
+                columns.append(values)
+            if np is not None:
+                ids = np.frombuffer(columns[0], dtype=np.int64)
+                order = np.argsort(ids, kind='stable')
+                for column, dtype in zip(columns, (np.int64, np.float64, np.float64)):
+                    np.frombuffer(column, dtype=dtype)[order].tofile(out)
+            else:
+                order = sorted(range(count), key=columns[0].__getitem__)
+                for column in columns:
+                    array(column.typecode, (column[i] for i in order)).tofile(out)
+
+    for files in shard_files:
+        for raw_path in files:
+            os.remove(raw_path)
+    return count
+
+
+class CoordinateStore(object):
+    """Read-only, memory-mapped view of a store written by build_store()"""
+
+    def __init__(self, path=COORDS_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, self.count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a node coordinate store" % path)
+
+        offsets = [HEADER.size + i * 8 * self.count for i in range(3)]
+        if np is not None:
+            self._mmap = None
+            self.ids, self.lats, self.lons = [
+                np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(self.count,))
+                if self.count else np.empty(0, dtype=dtype)
+                for dtype, offset in zip((np.int64, np.float64, np.float64), offsets)]
+        else:
+            with open(path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(self._mmap)
+            self.ids, self.lats, self.lons = [
+                view[offset:offset + 8 * self.count].cast(typecode)
+                for typecode, offset in zip('qdd', offsets)]
+
+    def __len__(self):
+        return self.count
+
+    def get(self, node_id):
+        """(lat, lon) of one node, or None if the store does not have it"""
+        if np is not None:
+            i = int(np.searchsorted(self.ids, node_id))
+        else:
+            i = bisect_left(self.ids, node_id)
+        if i < self.count and self.ids[i] == node_id:
+            return float(self.lats[i]), float(self.lons[i])
+        return None
+
+    def lookup(self, node_ids):
+        """(lat, lon) of every node id, in order; NaN for ids not in the store
+
+        With numpy this is one searchsorted over the mapped ids and returns a
+        float64 array of shape (len(node_ids), 2); without numpy, a list of
+        (lat, lon) tuples.
+        """
+        if np is None:
+            return [self.get(int(node_id)) or MISSING for node_id in node_ids]
+
+        wanted = np.asarray(node_ids, dtype=np.int64)
+        coords = np.full((len(wanted), 2), np.nan)
+        if not self.count:
+            return coords
+        index = np.searchsorted(self.ids, wanted)
+        np.minimum(index, self.count - 1, out=index)
+        found = self.ids[index] == wanted
+        coords[found, 0] = self.lats[index[found]]
+        coords[found, 1] = self.lons[index[found]]
+        return coords
+
+    def close(self):
+        self.ids = self.lats = self.lons = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+def iter_way_coordinates(store, ways_nodes_path='ways_nodes.csv'):
+    """Yield (way id, coordinates) for every way in a ways_nodes CSV
+
+    Rows are grouped by way id and put in position order, and each way's
+    node ids are resolved with a single store.lookup().
+    """
+    with open(ways_nodes_path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        for way_id, rows in groupby(reader, key=lambda row: row['id']):
+            rows = sorted(rows, key=lambda row: int(row['position']))
+            yield int(way_id), store.lookup([int(row['node_id']) for row in rows])
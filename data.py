@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Shape the Chicago OSM extract into the CSV files loaded into SQLite: nodes,
+ ways and relations, each with their tags, plus the way nodes and relation
+ members in order.  All three element types come out of the same single
+ pass over the file.
+
+ shape_record() shapes an element into plain row tuples in *_FIELDS order,
+ which write_elements() hands to csv.writer.writerows() in batches, so no
+ dict is built per tag, way node or row.  shape_element() still returns the
+ notebook's dicts (record_element() of the same record) for validation and
+ any other caller.
+
+ process_map() runs serially by default.  With workers > 1 the file is cut
+ into element-aligned byte ranges, each range is shaped and validated in a
+ worker process into its own CSV shards, and the shards are concatenated in
+ file order.  Every row is formatted by the same writer code either way, so
+ the merged CSVs are byte-for-byte identical to the serial output.
+ '''
+
+import csv
+import multiprocessing
+import os
+import pprint
+import re
+import shutil
+import tempfile
+import time
+from contextlib import ExitStack, nullcontext
+from io import BytesIO
+
+from Schema import schema
+from columnar import open_parquet_writers, parquet_path
+from coords import COORDS_PATH, CoordinateWriter, build_store
+from metrics import Metrics
+from validator import Validator, ValidationPolicy
+import cleaning
+from cleaning import clean_value
+from stream import file_format, get_element
+from summary import Summary, SUMMARY_PATH
+
+OSM_PATH = "chicago.osm"
+
+NODES_PATH = "nodes.csv"
+NODE_TAGS_PATH = "nodes_tags.csv"
+WAYS_PATH = "ways.csv"
+WAY_NODES_PATH = "ways_nodes.csv"
+WAY_TAGS_PATH = "ways_tags.csv"
+RELATIONS_PATH = "relations.csv"
+RELATION_TAGS_PATH = "relations_tags.csv"
+RELATION_MEMBERS_PATH = "relations_members.csv"
+
+LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
+PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+
+SCHEMA = schema
+
+NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+RELATION_MEMBERS_FIELDS = ['id', 'member_type', 'member_id', 'role', 'position']
+
+# top level elements shaped into rows
+ELEMENT_TAGS = ('node', 'way', 'relation')
+
+# shaped element key -> (csv path, csv fields), in the order the files are written
+OUTPUTS = [
+    ('node', NODES_PATH, NODE_FIELDS),
+    ('node_tags', NODE_TAGS_PATH, NODE_TAGS_FIELDS),
+    ('way', WAYS_PATH, WAY_FIELDS),
+    ('way_nodes', WAY_NODES_PATH, WAY_NODES_FIELDS),
+    ('way_tags', WAY_TAGS_PATH, WAY_TAGS_FIELDS),
+    ('relation', RELATIONS_PATH, RELATION_FIELDS),
+    ('relation_members', RELATION_MEMBERS_PATH, RELATION_MEMBERS_FIELDS),
+    ('relation_tags', RELATION_TAGS_PATH, RELATION_TAGS_FIELDS),
+]
+
+
+# ### Shaping up the element
+
+# element tag -> its attribute fields and the shaped element keys of its
+# record, in record (and shape_element() dict) order
+ATTR_FIELDS = {'node': NODE_FIELDS, 'way': WAY_FIELDS, 'relation': RELATION_FIELDS}
+RECORD_KEYS = {
+    'node': ('node', 'node_tags'),
+    'way': ('way', 'way_nodes', 'way_tags'),
+    'relation': ('relation', 'relation_members', 'relation_tags'),
+}
+OUTPUT_FIELDS = {name: fields for name, _, fields in OUTPUTS}
+
+
+def shape_record(element, attr_fields=None, problem_chars=PROBLEMCHARS, default_tag_type='regular'):
+    """Clean and shape node, way or relation XML element to row tuples
+
+    Returns (node row, tag rows) for a node and (way row, way node rows, tag
+    rows) or (relation row, member rows, tag rows) for a way or relation,
+    every row a tuple in the order of its *_FIELDS list, or None for any
+    other element.  attr_fields overrides the attributes of the element row.
+    """
+    element_type = element.tag
+    if element_type not in ATTR_FIELDS:
+        return None
+    get = element.attrib.get
+    element_id = get('id')
+    row = tuple(map(get, attr_fields or ATTR_FIELDS[element_type]))
+
+    tags = []  # Handle secondary tags the same way for every element type
+    refs = []  # way nodes or relation members, in order
+    for i in element:
+        child = i.attrib
+
+        if i.tag == 'tag':
+            key = child.get('k')
+            if problem_chars.search(key):
+                continue
+
+            #clean street names, phone numbers and postal codes (cleaning.RULES)
+            value = clean_value(key, child.get('v'))
+
+            if LOWER_COLON.search(key):
+                # 'addr:street' -> type 'addr', key 'street'; later colons stay in the key
+                key_type, _, key = key.partition(':')
+                tags.append((element_id, key, value, key_type))
+            else:
+                tags.append((element_id, key, value, default_tag_type))
+
+        elif i.tag == 'nd':
+            refs.append((element_id, child.get('ref'), len(refs)))
+
+        elif i.tag == 'member':
+            refs.append((element_id, child.get('type'), child.get('ref'), child.get('role') or '', len(refs)))
+
+    if element_type == 'node':
+        return row, tags
+    return row, refs, tags
+
+
+def record_element(element_type, record, attr_fields=None):
+    """The shape_element() dict of a shape_record() record"""
+    keys = RECORD_KEYS[element_type]
+    el = {keys[0]: dict(zip(attr_fields or ATTR_FIELDS[element_type], record[0]))}
+    for key, rows in zip(keys[1:], record[1:]):
+        fields = OUTPUT_FIELDS[key]
+        el[key] = [dict(zip(fields, row)) for row in rows]
+    return el
+
+
+def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular',
+                  relation_attr_fields=RELATION_FIELDS):
+    """Clean and shape node, way or relation XML element to Python dict"""
+    attr_fields = {'node': node_attr_fields, 'way': way_attr_fields,
+                   'relation': relation_attr_fields}.get(element.tag)
+    record = shape_record(element, attr_fields, problem_chars, default_tag_type)
+    if record is not None:
+        return record_element(element.tag, record, attr_fields)
+
+
+def validate_element(element, validator, schema=SCHEMA):
+    """Raise ValidationError if element does not match schema"""
+    if validator.validate(element, schema) is not True:
+        field, errors = next(iter(validator.errors.items()))
+        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
+        error_string = pprint.pformat(errors)
+
+        raise Exception(message_string.format(field, error_string))
+
+
+class UnicodeDictWriter(csv.DictWriter, object):
+    """Extend csv.DictWriter to handle Unicode input"""
+
+    def writerow(self, row):
+        super(UnicodeDictWriter, self).writerow({
+            k: (v.encode('utf-8') if isinstance(v, bytes) else v) for k, v in row.items()
+        })
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+# ### Writing the CSV files
+
+def open_writers(stack, paths, header=True):
+    """Open one csv.writer per entry of OUTPUTS, keyed by shaped element key
+
+    The writers take shape_record() row tuples, already in field order.
+    """
+    writers = {}
+    for (name, _, fields), path in zip(OUTPUTS, paths):
+        csv_file = stack.enter_context(open(path, 'w', encoding="utf-8", newline=''))
+        writers[name] = csv.writer(csv_file)
+        if header:
+            writers[name].writerow(fields)
+    return writers
+
+
+def new_validator():
+    """Schema validator compiled once per schema (validator.Validator)"""
+    return Validator()
+
+
+# elements whose rows are buffered before each writerows() call
+WRITE_BATCH = 1000
+
+# element tag -> positions of user and uid in its record's element row
+USER_COLUMNS = {element_type: (fields.index('user'), fields.index('uid'))
+                for element_type, fields in ATTR_FIELDS.items()}
+
+
+def write_elements(elements, writers, validate, summary=None, coords=None, metrics=None):
+    """Shape, optionally validate and write every element to writers
+
+    Elements are shaped with shape_record() and their row tuples written
+    WRITE_BATCH elements at a time with writerows(); the shape_element()
+    dicts are only built for the elements that get validated.
+    validate is True (every element, raise on the first failure), False, or
+    a ValidationPolicy that samples elements and collects the failures.
+    Every shaped element is also counted into summary, and every node's
+    coordinates added to the CoordinateWriter coords, if given.  With a
+    metrics.Metrics, the parse, shape, validate and write stages are timed.
+    """
+    validator = new_validator() if validate else None
+    policy = validate if isinstance(validate, ValidationPolicy) else None
+    buffers = {key: [] for key in writers}
+    pending = 0
+
+    timing = metrics is not None
+    if timing:
+        clock = time.perf_counter
+        elements = metrics.timed_iter('parse', elements)
+        shaping, checking, writing = metrics.stage('shape'), metrics.stage('validate'), metrics.stage('write')
+
+    def flush():
+        for key, rows in buffers.items():
+            if rows:
+                writers[key].writerows(rows)
+                del rows[:]
+
+    for element in elements:
+        if timing:
+            start = clock()
+        record = shape_record(element)
+        if timing:
+            shaped = clock()
+            shaping.seconds += shaped - start
+            shaping.count += 1
+        if record is None:
+            continue
+
+        element_type = element.tag
+        validated = False
+        if policy is not None:
+            if policy.selects(element_type):
+                policy.validate(record_element(element_type, record), validator, SCHEMA)
+                validated = True
+        elif validator is not None:
+            validate_element(record_element(element_type, record), validator)
+            validated = True
+        if timing:
+            start = clock()
+            checking.seconds += start - shaped
+            checking.count += validated  # elements a policy skipped are not counted
+
+        row = record[0]
+        if summary is not None:
+            user, uid = USER_COLUMNS[element_type]
+            summary.add_record(element_type, row[user], row[uid], record[-1])
+        if coords is not None and element_type == 'node' and row[1] is not None and row[2] is not None:
+            coords.add(row[0], row[1], row[2])  # id, lat, lon
+
+        keys = RECORD_KEYS[element_type]
+        buffers[keys[0]].append(row)
+        for key, rows in zip(keys[1:], record[1:]):
+            buffers[key].extend(rows)
+        pending += 1
+        if pending >= WRITE_BATCH:
+            flush()
+            pending = 0
+        if timing:
+            writing.seconds += clock() - start
+            writing.count += 1
+
+    with metrics.timed('write') if timing else nullcontext():
+        flush()
+    return policy
+
+
+def output_bytes(paths):
+    return sum(os.path.getsize(path) for path in paths if path is not None and os.path.exists(path))
+
+
+def process_map(file_in, validate, workers=1, output='csv', coords_path=COORDS_PATH, metrics=None):
+    """Iteratively process each XML element and write to csv(s)
+
+    Returns a run summary: 'validation' holds the summary() of a
+    ValidationPolicy passed as validate (None otherwise) and 'cleaning_cache'
+    the hits and misses of the value cleaning caches for this run, and
+    'summary' the headline totals counted on the way (summary.Summary), whose
+    counters are also written to SUMMARY_PATH for database.load_csv().
+    workers > 1 shapes element-aligned chunks of file_in in that many
+    processes; workers=None uses every CPU core (plain XML only: compressed
+    and PBF input is read serially).  output='parquet' writes
+    typed Parquet files (nodes.parquet, ...) next to the CSV paths instead
+    of CSVs.  Node coordinates are also stored in coords_path
+    (coords.CoordinateStore; 'node_coords' is the count), unless it is None.
+    A metrics.Metrics collects per-stage timings, bytes and cleaning
+    counters (summed over the workers in parallel mode).
+    """
+    if output not in ('csv', 'parquet'):
+        raise ValueError("output must be 'csv' or 'parquet', not %r" % (output,))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and output == 'csv' and file_format(file_in) == 'xml':
+        policy, cache_info, summary, node_coords = process_map_parallel(file_in, validate, workers, coords_path,
+                                                                        metrics)
+    else:
+        summary = Summary()
+        rules_before = cleaning.cleaner.rule_counts()
+        cache_before = cleaning.cleaner.cache_info()
+        with ExitStack() as stack:
+            if output == 'parquet':
+                writers = open_parquet_writers(stack, OUTPUTS)
+            else:
+                writers = open_writers(stack, [path for _, path, _ in OUTPUTS])
+            coords = None
+            if coords_path is not None:
+                coords = CoordinateWriter(coords_path)
+                stack.callback(coords.close)
+            policy = write_elements(get_element(file_in, tags=ELEMENT_TAGS), writers, validate,
+                                    summary, coords, metrics)
+        node_coords = build_store([coords_path], coords_path) if coords_path is not None else None
+        cache_info = cleaning.cache_delta(cache_before, cleaning.cleaner.cache_info())
+        if metrics is not None:
+            metrics.count_cleaning(rules_before, cleaning.cleaner.rule_counts(), cache_info)
+            if isinstance(file_in, str):
+                metrics.stage('parse').bytes_read += os.path.getsize(file_in)
+    summary.write_json(SUMMARY_PATH)
+
+    if metrics is not None:
+        paths = [path for _, path, _ in OUTPUTS]
+        if output == 'parquet':
+            paths = [parquet_path(path) for path in paths]
+        metrics.stage('write').bytes_written += output_bytes(paths + [coords_path, SUMMARY_PATH])
+
+    return {
+        'validation': policy.summary() if policy is not None else None,
+        'cleaning_cache': cache_info,
+        'summary': summary.totals(),
+        'node_coords': node_coords,
+    }
+
+
+# ### Parallel conversion
+
+ELEMENT_START_RE = re.compile(rb'<(?:node|way|relation)[\s/>]')
+CLOSING_ROOT = b'</osm>'
+SCAN_BLOCK = 1 << 20
+
+
+def find_element_start(osm_file, offset, limit):
+    """Byte offset of the first top level element starting at or after offset
+
+    node, way and relation never nest and '<' is always escaped inside
+    attribute values, so the first match of ELEMENT_START_RE is a top level
+    element boundary.  Returns limit if there is none before it.
+    """
+    overlap = 16
+    while offset < limit:
+        osm_file.seek(offset)
+        block = osm_file.read(min(SCAN_BLOCK, limit - offset) + overlap)
+        m = ELEMENT_START_RE.search(block)
+        if m and offset + m.start() < limit:
+            return offset + m.start()
+        offset += SCAN_BLOCK
+    return limit
+
+
+def split_osm(file_in, chunks):
+    """Split file_in into at most `chunks` element-aligned (start, end) byte ranges"""
+    size = os.path.getsize(file_in)
+    with open(file_in, 'rb') as osm_file:
+        osm_file.seek(max(0, size - SCAN_BLOCK))
+        tail = osm_file.read()
+        closing = tail.rfind(CLOSING_ROOT)
+        if closing < 0:
+            raise ValueError("%s: no closing </osm> in its last %d bytes; truncated file?" % (file_in, len(tail)))
+        end = size - len(tail) + closing
+
+        first = find_element_start(osm_file, 0, end)
+        step = max(1, (end - first) // chunks)
+        starts = [first]
+        for i in range(1, chunks):
+            start = find_element_start(osm_file, first + i * step, end)
+            if start > starts[-1]:
+                starts.append(start)
+
+    starts = [start for start in starts if start < end]
+    return list(zip(starts, starts[1:] + [end]))
+
+
+def _process_chunk(args):
+    """Worker: shape one byte range of the OSM file into headerless CSV shards"""
+    file_in, start, end, validate, shard_paths, coords_shard, instrument = args
+    with open(file_in, 'rb') as osm_file:
+        osm_file.seek(start)
+        chunk = osm_file.read(end - start)
+
+    summary = Summary()
+    metrics = Metrics() if instrument else None
+    rules_before = cleaning.cleaner.rule_counts()
+    cache_before = cleaning.cleaner.cache_info()
+    with ExitStack() as stack:
+        writers = open_writers(stack, shard_paths, header=False)
+        coords = None
+        if coords_shard is not None:
+            coords = CoordinateWriter(coords_shard)
+            stack.callback(coords.close)
+        xml = BytesIO(b'<osm>' + chunk + CLOSING_ROOT)
+        policy = write_elements(get_element(xml, tags=ELEMENT_TAGS), writers, validate, summary, coords,
+                                metrics)
+    cache_info = cleaning.cache_delta(cache_before, cleaning.cleaner.cache_info())
+    if metrics is not None:
+        metrics.stage('parse').bytes_read += len(chunk)
+        metrics.count_cleaning(rules_before, cleaning.cleaner.rule_counts())
+    return shard_paths, policy, cache_info, summary, metrics
+
+
+def process_map_parallel(file_in, validate, workers, coords_path=None, metrics=None):
+    """Shape file_in across `workers` processes and merge the CSV shards
+
+    A ValidationPolicy is copied into every worker, so sampling counts
+    (every Nth, first K, until clean) apply per chunk; the workers' results
+    are merged into the returned policy.  Each worker process keeps its own
+    cleaning caches; their hits and misses are summed, as are the chunks'
+    summaries.  Each chunk writes its own node coordinate shard, combined in
+    file order into coords_path.  Worker stage times are summed into
+    metrics (so they add up to more than the wall time); concatenating the
+    shards is the 'merge' stage.
+    """
+    policy = None
+    cache_info = {}
+    summary = Summary()
+    node_coords = None
+    coords_shards = []
+    paths = [path for _, path, _ in OUTPUTS]
+    shard_dir = tempfile.mkdtemp(prefix='osm-shards-', dir=os.path.dirname(os.path.abspath(paths[0])))
+    try:
+        jobs = []
+        for n, (start, end) in enumerate(split_osm(file_in, workers * 4)):
+            shard_paths = [os.path.join(shard_dir, '%05d-%s' % (n, os.path.basename(path)))
+                           for path in paths]
+            chunk_validate = validate
+            if isinstance(validate, ValidationPolicy):
+                chunk_validate = validate.for_chunk(n)
+            coords_shard = None
+            if coords_path is not None:
+                coords_shard = os.path.join(shard_dir, '%05d-coords' % n)
+                coords_shards.append(coords_shard)
+            jobs.append((file_in, start, end, chunk_validate, shard_paths, coords_shard, metrics is not None))
+
+        with ExitStack() as stack:
+            # headers come from the same writers as the serial path
+            open_writers(stack, paths)
+
+        with multiprocessing.Pool(workers) as pool, ExitStack() as stack:
+            outputs = [stack.enter_context(open(path, 'ab')) for path in paths]
+            for shard_paths, chunk_policy, chunk_cache_info, chunk_summary, chunk_metrics in pool.imap(
+                    _process_chunk, jobs):
+                if metrics is not None:
+                    merge_start = time.perf_counter()
+                    metrics.merge(chunk_metrics)
+                    metrics.count_cleaning({}, {}, chunk_cache_info)
+                cleaning.merge_cache_info(cache_info, chunk_cache_info)
+                summary.merge(chunk_summary)
+                if chunk_policy is not None:
+                    policy = chunk_policy if policy is None else policy.merge(chunk_policy)
+                for shard_path, output in zip(shard_paths, outputs):
+                    with open(shard_path, 'rb') as shard:
+                        shutil.copyfileobj(shard, output)
+                    os.remove(shard_path)
+                if metrics is not None:
+                    metrics.stage('merge').seconds += time.perf_counter() - merge_start
+                    metrics.stage('merge').count += 1
+
+        if coords_path is not None:
+            node_coords = build_store(coords_shards, coords_path)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    return policy, cache_info, summary, node_coords
+
+
+if __name__ == '__main__':
+    process_map(OSM_PATH, validate=True)
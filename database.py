@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Load the shaped Chicago OSM data into SQLite (chicago.db).
+
+ load_csv() is the notebook's route: read back the CSVs written by
+ data.process_map().  Relations have their own tables (relations,
+ relations_tags and relations_members), filled in the same pass as nodes
+ and ways.  load_osm() skips the CSV round trip and streams
+ shaped elements from shape_record() straight into the tables, inserting
+ batches with executemany inside one explicit transaction under bulk-load
+ pragmas, and only builds the indexes once the rows are in.
+
+ After either load, finish_load() materializes all_tags (element_type, id,
+ key, value, type), the union of nodes_tags, ways_tags and relations_tags,
+ and builds the indexes.  With FULL_TEXT it also builds all_tags_fts, an FTS5 trigram
+ index over all_tags.value kept in sync by triggers, for the substring and
+ prefix searches (queries.search_tags()).  With SPATIAL it builds the R*Tree
+ indexes nodes_rtree (one point per node) and ways_rtree (the bounding box
+ of each way's nodes) for queries.tags_in_box() / tags_near().  It also stores the headline
+ statistics (summary.Summary) in summary_counters and summary_totals:
+ load_osm() counts them while streaming, load_csv() reads the counts
+ process_map() wrote next to the CSVs (unless their element totals disagree
+ with the CSV row counts), and anything else aggregates them once from the
+ loaded tables.
+ '''
+
+import csv
+import os
+import sqlite3
+import time
+from contextlib import nullcontext
+from itertools import islice
+from operator import itemgetter
+
+from Schema import schema, tables
+from data import (ELEMENT_TAGS, OSM_PATH, RECORD_KEYS, USER_COLUMNS, new_validator, record_element,
+                  shape_record, validate_element)
+from stream import get_element
+from summary import STORED_TABLES, Summary, SUMMARY_PATH
+
+DB_PATH = 'chicago.db'
+
+BATCH_SIZE = 10000
+
+
+def element_columns(element):
+    """Column names of a shaped element, in schema (and CSV field) order"""
+    spec = schema[element]
+    if spec['type'] == 'list':
+        spec = spec['schema']
+    return list(spec['schema'].keys())
+
+
+# (table, shaped element key, csv path, columns, create statement)
+TABLES = [(t['name'], t['element'], t['csv'], element_columns(t['element']), t['create'])
+          for t in tables]
+
+# every tag of every element in one table, so tag questions need one index
+# probe instead of scanning nodes_tags UNION ALL ways_tags UNION ALL relations_tags
+CREATE_ALL_TAGS = '''
+CREATE TABLE all_tags (
+    element_type TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    type TEXT
+)'''
+
+# element type -> tag table feeding all_tags
+TAG_TABLES = [('node', 'nodes_tags'), ('way', 'ways_tags'), ('relation', 'relations_tags')]
+
+# optional full-text index over all_tags.value; the trigram tokenizer lets
+# FTS5 answer LIKE '%...%' and 'prefix%' from the index (SQLite 3.34+)
+FULL_TEXT = True
+
+CREATE_ALL_TAGS_FTS = '''
+CREATE VIRTUAL TABLE all_tags_fts USING fts5 (
+    value,
+    content='all_tags',
+    content_rowid='rowid',
+    tokenize='trigram'
+)'''
+
+# keep all_tags_fts in step with all_tags after the load (changes.py)
+ALL_TAGS_FTS_TRIGGERS = [
+    '''CREATE TRIGGER all_tags_fts_insert AFTER INSERT ON all_tags BEGIN
+        INSERT INTO all_tags_fts (rowid, value) VALUES (new.rowid, new.value);
+    END''',
+    '''CREATE TRIGGER all_tags_fts_delete AFTER DELETE ON all_tags BEGIN
+        INSERT INTO all_tags_fts (all_tags_fts, rowid, value) VALUES ('delete', old.rowid, old.value);
+    END''',
+    '''CREATE TRIGGER all_tags_fts_update AFTER UPDATE OF value ON all_tags BEGIN
+        INSERT INTO all_tags_fts (all_tags_fts, rowid, value) VALUES ('delete', old.rowid, old.value);
+        INSERT INTO all_tags_fts (rowid, value) VALUES (new.rowid, new.value);
+    END''',
+]
+
+# R*Tree indexes over node points and way bounding boxes (SQLite rtree module)
+SPATIAL = True
+
+CREATE_NODES_RTREE = 'CREATE VIRTUAL TABLE nodes_rtree USING rtree (id, min_lat, max_lat, min_lon, max_lon)'
+CREATE_WAYS_RTREE = 'CREATE VIRTUAL TABLE ways_rtree USING rtree (id, min_lat, max_lat, min_lon, max_lon)'
+
+NODES_RTREE_INSERT = '''
+INSERT OR REPLACE INTO nodes_rtree (id, min_lat, max_lat, min_lon, max_lon)
+SELECT id, lat, lat, lon, lon FROM nodes WHERE lat IS NOT NULL AND lon IS NOT NULL'''
+
+# bounding box of every way (or of the ways selected by a WHERE clause on ways_nodes.id)
+WAYS_RTREE_INSERT = '''
+INSERT OR REPLACE INTO ways_rtree (id, min_lat, max_lat, min_lon, max_lon)
+SELECT ways_nodes.id, min(nodes.lat), max(nodes.lat), min(nodes.lon), max(nodes.lon)
+FROM ways_nodes JOIN nodes ON nodes.id = ways_nodes.node_id
+{0}
+GROUP BY ways_nodes.id'''
+
+# (index, table, columns), built after the bulk load and followed by ANALYZE
+INDEXES = [
+    # key='amenity', key='religion', key LIKE '%cuisine%': covering for key/value
+    ('nodes_tags_key_value', 'nodes_tags', 'key, value'),
+    ('ways_tags_key_value', 'ways_tags', 'key, value'),
+    # value='place_of_worship', value LIKE ...: probe or scan the smaller index
+    ('nodes_tags_value', 'nodes_tags', 'value'),
+    ('ways_tags_value', 'ways_tags', 'value, id'),
+    # tags of one element (joins, incremental updates)
+    ('nodes_tags_id_key', 'nodes_tags', 'id, key'),
+    ('ways_tags_id_key', 'ways_tags', 'id, key'),
+    # chosen type of nodes
+    ('nodes_tags_type', 'nodes_tags', 'type'),
+    # way geometry in order, and the ways using a node
+    ('ways_nodes_id_position', 'ways_nodes', 'id, position'),
+    ('ways_nodes_node_id', 'ways_nodes', 'node_id'),
+    # routes and multipolygons by tag, their members in order, and the relations using an element
+    ('relations_tags_key_value', 'relations_tags', 'key, value'),
+    ('relations_tags_id_key', 'relations_tags', 'id, key'),
+    ('relations_members_id_position', 'relations_members', 'id, position'),
+    ('relations_members_member', 'relations_members', 'member_type, member_id'),
+    # unique users and top contributors
+    ('nodes_uid', 'nodes', 'uid'),
+    ('ways_uid', 'ways', 'uid'),
+    ('nodes_user', 'nodes', 'user'),
+    ('ways_user', 'ways', 'user'),
+    # the unified tag table
+    ('all_tags_key_value', 'all_tags', 'key, value'),
+    ('all_tags_value', 'all_tags', 'value, key'),
+    ('all_tags_element', 'all_tags', 'element_type, id'),
+]
+
+# pragmas for the bulk load: no fsyncs, journal in memory; a crashed load is rerun from the OSM file
+BULK_PRAGMAS = [
+    'PRAGMA journal_mode = MEMORY',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA cache_size = -262144',
+    'PRAGMA temp_store = MEMORY',
+]
+
+DEFAULT_PRAGMAS = [
+    'PRAGMA journal_mode = DELETE',
+    'PRAGMA synchronous = FULL',
+]
+
+
+# shaped element key -> table columns, in insert order
+ELEMENT_COLUMNS = {key: columns for _, key, _, columns, _ in TABLES}
+
+
+def element_rows(el):
+    """Yield (shaped element key, list of row tuples) for a shaped element"""
+    for key, value in el.items():
+        rows = [value] if isinstance(value, dict) else value
+        columns = ELEMENT_COLUMNS[key]
+        yield key, [tuple(row[column] for column in columns) for row in rows]
+
+
+def insert_statement(table, columns):
+    return 'INSERT INTO {0} ({1}) VALUES ({2});'.format(
+        table, ', '.join(columns), ', '.join('?' * len(columns)))
+
+
+def create_tables(cur):
+    """Drop and recreate every table"""
+    for table, _, _, _, create in TABLES:
+        cur.execute('DROP TABLE IF EXISTS {0}'.format(table))
+        cur.execute(create)
+
+
+def build_all_tags(cur):
+    """(Re)build all_tags from the loaded tag tables"""
+    cur.execute('DROP TABLE IF EXISTS all_tags')
+    cur.execute(CREATE_ALL_TAGS)
+    for element_type, table in TAG_TABLES:
+        cur.execute('INSERT INTO all_tags (element_type, id, key, value, type) '
+                    'SELECT ?, id, key, value, type FROM {0}'.format(table), (element_type,))
+
+
+def build_full_text(cur):
+    """Index all_tags.value with FTS5; returns False if this SQLite lacks FTS5 trigrams"""
+    cur.execute('DROP TABLE IF EXISTS all_tags_fts')
+    try:
+        cur.execute(CREATE_ALL_TAGS_FTS)
+    except sqlite3.OperationalError as e:
+        print("skipping full-text index: %s" % e)
+        return False
+    cur.execute("INSERT INTO all_tags_fts (all_tags_fts) VALUES ('rebuild')")
+    for trigger in ALL_TAGS_FTS_TRIGGERS:
+        cur.execute(trigger)
+    return True
+
+
+def build_spatial(cur):
+    """(Re)build nodes_rtree and ways_rtree; returns False if this SQLite lacks R*Tree"""
+    cur.execute('DROP TABLE IF EXISTS nodes_rtree')
+    cur.execute('DROP TABLE IF EXISTS ways_rtree')
+    try:
+        cur.execute(CREATE_NODES_RTREE)
+        cur.execute(CREATE_WAYS_RTREE)
+    except sqlite3.OperationalError as e:
+        print("skipping spatial index: %s" % e)
+        return False
+    cur.execute(NODES_RTREE_INSERT)
+    cur.execute(WAYS_RTREE_INSERT.format(''))
+    return True
+
+
+def finish_load(cur, full_text=None, summary=None):
+    """Derived tables and indexes, built once the base tables are loaded
+
+    summary is the Summary counted during the load; without one it is
+    aggregated from the loaded tables.
+    """
+    build_all_tags(cur)
+    # an index left by an earlier load no longer matches the new all_tags
+    cur.execute('DROP TABLE IF EXISTS all_tags_fts')
+    if FULL_TEXT if full_text is None else full_text:
+        build_full_text(cur)
+    if summary is None:
+        summary = Summary.from_db(cur)
+    summary.save(cur)
+    create_indexes(cur)
+    # after the indexes, so way boxes are grouped off ways_nodes_id_position
+    if SPATIAL:
+        build_spatial(cur)
+
+
+def create_indexes(cur):
+    """Create every index in INDEXES and refresh the planner statistics"""
+    for index, table, columns in INDEXES:
+        cur.execute('CREATE INDEX IF NOT EXISTS {0} ON {1} ({2})'.format(index, table, columns))
+    cur.execute('ANALYZE')
+
+
+def drop_indexes(cur):
+    for index, _, _ in INDEXES:
+        cur.execute('DROP INDEX IF EXISTS {0}'.format(index))
+    cur.execute('DROP TABLE IF EXISTS sqlite_stat1')
+
+
+def time_queries(conn, queries, repeat=3):
+    """Best of `repeat` wall times, in seconds, of every named query"""
+    timings = {}
+    for name, query in queries.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(query).fetchall()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+    return timings
+
+
+def benchmark_indexes(db_path=DB_PATH, repeat=3):
+    """Time the notebook queries without and then with INDEXES; leaves db_path indexed"""
+    from queries import QUERIES
+
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    try:
+        drop_indexes(cur)
+        conn.commit()
+        before = time_queries(conn, QUERIES, repeat)
+        create_indexes(cur)
+        conn.commit()
+        after = time_queries(conn, QUERIES, repeat)
+    finally:
+        conn.close()
+
+    print("%-15s %12s %12s %8s" % ('query', 'before (ms)', 'after (ms)', 'speedup'))
+    for name in QUERIES:
+        print("%-15s %12.2f %12.2f %7.1fx" % (
+            name, before[name] * 1000, after[name] * 1000, before[name] / after[name] if after[name] else 0))
+    return before, after
+
+
+def import_csv(conn, table, path=None, batch_size=BATCH_SIZE):
+    """Stream one CSV into its table batch_size rows at a time
+
+    Only one batch of rows is in memory at any point and every batch is
+    committed, so peak memory does not grow with the size of the CSV.
+    Returns (rows, seconds) and prints the rows/sec achieved.
+    """
+    spec = next(t for t in TABLES if t[0] == table)
+    _, _, csv_path, columns, _ = spec
+    statement = insert_statement(table, columns)
+    cur = conn.cursor()
+
+    start = time.perf_counter()
+    count = 0
+    with open(path or csv_path, 'r', encoding="utf-8", newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        # reorder the CSV columns into insert order
+        row_values = itemgetter(*[header.index(column) for column in columns])
+        rows = (row_values(row) for row in reader)
+
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            cur.executemany(statement, batch)
+            conn.commit()
+            count += len(batch)
+
+    seconds = time.perf_counter() - start
+    print("%s: %d rows in %.2fs (%d rows/sec)" % (table, count, seconds, count / seconds if seconds else 0))
+    return count, seconds
+
+
+def import_parquet(conn, table, path=None, batch_size=BATCH_SIZE):
+    """Stream a Parquet file from data.process_map(output='parquet') into its table
+
+    Columns arrive already typed, so nothing is parsed from text.  Like
+    import_csv(), inserts and commits batch_size rows at a time and returns
+    (rows, seconds).
+    """
+    import pyarrow.parquet as pq
+    from columnar import parquet_path
+
+    _, _, csv_path, columns, _ = next(t for t in TABLES if t[0] == table)
+    statement = insert_statement(table, columns)
+    cur = conn.cursor()
+
+    start = time.perf_counter()
+    count = 0
+    parquet_file = pq.ParquetFile(path or parquet_path(csv_path))
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        cur.executemany(statement, zip(*[batch.column(column).to_pylist() for column in columns]))
+        conn.commit()
+        count += batch.num_rows
+
+    seconds = time.perf_counter() - start
+    print("%s: %d rows in %.2fs (%d rows/sec)" % (table, count, seconds, count / seconds if seconds else 0))
+    return count, seconds
+
+
+def summary_matches(summary, stats):
+    """Whether summary's element totals equal the rows import_csv() loaded (stats)"""
+    totals = summary.totals()
+    return all(totals[table] == stats[table][0] for table, _ in STORED_TABLES.values())
+
+
+def load_csv(db_path=DB_PATH, batch_size=BATCH_SIZE, summary_path=SUMMARY_PATH):
+    """Load the CSVs written by data.process_map() into db_path"""
+    summary = Summary.read_json(summary_path) if os.path.exists(summary_path) else None
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    create_tables(cur)
+    conn.commit()
+
+    stats = {}
+    for table, _, _, _, _ in TABLES:
+        stats[table] = import_csv(conn, table, batch_size=batch_size)
+
+    if summary is not None and not summary_matches(summary, stats):
+        print("%s does not match the CSV row counts; counting the summary from the tables" % summary_path)
+        summary = None
+    finish_load(cur, summary=summary)
+    conn.commit()
+    conn.close()
+    return stats
+
+
+def load_osm(file_in=OSM_PATH, db_path=DB_PATH, validate=False, batch_size=BATCH_SIZE, metrics=None):
+    """Stream shaped elements from file_in straight into db_path, no CSVs
+
+    Rows go from data.shape_record() into the insert batches as they are.
+    A metrics.Metrics times the parse, shape, validate, insert and finish
+    stages.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    cur = conn.cursor()
+    for pragma in BULK_PRAGMAS:
+        cur.execute(pragma)
+
+    statements = {key: insert_statement(table, columns) for table, key, _, columns, _ in TABLES}
+    batches = {key: [] for key in statements}
+    validator = new_validator() if validate is True else None
+    summary = Summary()
+
+    elements = get_element(file_in, tags=ELEMENT_TAGS)
+    timing = metrics is not None
+    if timing:
+        clock = time.perf_counter
+        elements = metrics.timed_iter('parse', elements)
+        shaping, checking, inserting = metrics.stage('shape'), metrics.stage('validate'), metrics.stage('insert')
+        if isinstance(file_in, str):
+            metrics.stage('parse').bytes_read += os.path.getsize(file_in)
+
+    def flush(key):
+        cur.executemany(statements[key], batches[key])
+        del batches[key][:]
+
+    cur.execute('BEGIN')
+    try:
+        create_tables(cur)
+        for element in elements:
+            if timing:
+                start = clock()
+            record = shape_record(element)
+            if timing:
+                shaped = clock()
+                shaping.seconds += shaped - start
+                shaping.count += 1
+            if record is None:
+                continue
+            element_type = element.tag
+            if validator is not None:
+                validate_element(record_element(element_type, record), validator)
+            if timing:
+                start = clock()
+                checking.seconds += start - shaped
+                checking.count += validator is not None
+            row = record[0]
+            user, uid = USER_COLUMNS[element_type]
+            summary.add_record(element_type, row[user], row[uid], record[-1])
+
+            # record rows are tuples in *_FIELDS order, the table column order
+            keys = RECORD_KEYS[element_type]
+            batch = batches[keys[0]]
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush(keys[0])
+            for key, rows in zip(keys[1:], record[1:]):
+                batch = batches[key]
+                batch.extend(rows)
+                if len(batch) >= batch_size:
+                    flush(key)
+            if timing:
+                inserting.seconds += clock() - start
+                inserting.count += 1
+
+        with metrics.timed('insert') if timing else nullcontext():
+            for key in batches:
+                flush(key)
+        with metrics.timed('finish') if timing else nullcontext():
+            finish_load(cur, summary=summary)
+            cur.execute('COMMIT')
+    except BaseException:
+        cur.execute('ROLLBACK')
+        raise
+    finally:
+        for pragma in DEFAULT_PRAGMAS:
+            cur.execute(pragma)
+        conn.close()
+    if timing:
+        metrics.stage('finish').bytes_written += os.path.getsize(db_path)
+
+
+if __name__ == '__main__':
+    load_osm(OSM_PATH, DB_PATH)
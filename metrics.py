@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Per-stage timing, counters and memory telemetry for the pipeline.
+
+ Pass a Metrics to data.process_map(), database.load_osm() or
+ audit.audit_all() and every stage records its time, the elements it
+ handled and the bytes it read or wrote:
+
+   parse     - pulling elements out of the XML parser
+   shape     - shape_record(), tag value cleaning included
+   validate  - schema validation
+   write     - CSV / Parquet rows (and the summary and coordinate stores)
+   insert    - SQLite batches (load_osm)
+   finish    - all_tags, indexes and derived tables (load_osm)
+   audit     - the audit visitors (audit_all)
+
+ Counters hold the cleaning rule calls and hits and the cleaning cache hits
+ and misses.  Once the run is done, emit() hands the report (stages with elements/sec, counters,
+ peak RSS and wall time) to every sink: LogSink prints lines, JsonSink
+ writes a JSON file and PrometheusSink a node_exporter textfile.
+
+ The default everywhere is metrics=None, which takes no timestamps at all:
+ the instrumented loops only test a local flag per element.
+ '''
+
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROMETHEUS_PREFIX = 'osm_pipeline'
+
+
+def peak_rss():
+    """Peak resident set size in bytes of this process and its finished children, or None"""
+    if resource is None:
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+    return scale * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+class Stage(object):
+    __slots__ = ('seconds', 'count', 'bytes_read', 'bytes_written')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.count = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+
+class Metrics(object):
+    """Stage timings and counters of one run, reported to sinks"""
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.started = time.perf_counter()
+
+    def stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage()
+        return stage
+
+    @contextmanager
+    def timed(self, name, count=0):
+        """Time a block as (part of) stage name"""
+        stage = self.stage(name)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds += time.perf_counter() - start
+            stage.count += count
+
+    def timed_iter(self, name, iterable):
+        """Iterate over iterable, timing every next() as stage name"""
+        return self._timed_iter(self.stage(name), iterable)
+
+    def _timed_iter(self, stage, iterable):
+        clock = time.perf_counter
+        it = iter(iterable)
+        while True:
+            start = clock()
+            try:
+                item = next(it)
+            except StopIteration:
+                stage.seconds += clock() - start
+                return
+            stage.seconds += clock() - start
+            stage.count += 1
+            yield item
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def count_cleaning(self, rules_before, rules_after, cache_delta=None):
+        """Counters for the cleaning rule calls/hits between two Cleaner.rule_counts() snapshots"""
+        for rule, after in rules_after.items():
+            before = rules_before.get(rule, {'calls': 0, 'hits': 0})
+            self.count('cleaning_rule_calls', after['calls'] - before['calls'], rule=rule)
+            self.count('cleaning_rule_hits', after['hits'] - before['hits'], rule=rule)
+        for key, info in (cache_delta or {}).items():
+            self.count('cleaning_cache_hits', info['hits'], key=key)
+            self.count('cleaning_cache_misses', info['misses'], key=key)
+
+    def merge(self, other):
+        """Add the stages and counters of another run (a worker's) to this one"""
+        for name, stage in other.stages.items():
+            mine = self.stage(name)
+            for field in Stage.__slots__:
+                setattr(mine, field, getattr(mine, field) + getattr(stage, field))
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        return self
+
+    def as_dict(self):
+        stages = OrderedDict()
+        for name, stage in self.stages.items():
+            stages[name] = {
+                'seconds': stage.seconds,
+                'elements': stage.count,
+                'elements_per_sec': stage.count / stage.seconds if stage.seconds else None,
+                'bytes_read': stage.bytes_read,
+                'bytes_written': stage.bytes_written,
+            }
+        return {
+            'wall_seconds': time.perf_counter() - self.started,
+            'peak_rss_bytes': peak_rss(),
+            'stages': stages,
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in self.counters.items()],
+        }
+
+    def emit(self):
+        """Send the report to every sink and return it"""
+        report = self.as_dict()
+        for sink in self.sinks:
+            sink.emit(report)
+        return report
+
+
+# ### Sinks
+
+class LogSink(object):
+    """Print one line per stage and counter"""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def emit(self, report):
+        out = self.stream or sys.stdout
+        for name, stage in report['stages'].items():
+            line = "%s: %d elements in %.2fs" % (name, stage['elements'], stage['seconds'])
+            if stage['elements_per_sec']:
+                line += " (%d elements/sec)" % stage['elements_per_sec']
+            if stage['bytes_read']:
+                line += ", %d bytes read" % stage['bytes_read']
+            if stage['bytes_written']:
+                line += ", %d bytes written" % stage['bytes_written']
+            print(line, file=out)
+        for counter in report['counters']:
+            labels = ','.join('%s=%s' % item for item in sorted(counter['labels'].items()))
+            print("%s{%s}: %d" % (counter['name'], labels, counter['value']), file=out)
+        if report['peak_rss_bytes'] is not None:
+            print("peak RSS: %.1f MB" % (report['peak_rss_bytes'] / 1e6), file=out)
+        print("wall time: %.2fs" % report['wall_seconds'], file=out)
+
+
+class JsonSink(object):
+    """Write the report as JSON to path"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, report):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+def _prometheus_labels(labels):
+    return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in sorted(labels.items())) + '}' if labels else ''
+
+
+class PrometheusSink(object):
+    """Write the report in the Prometheus text format (node_exporter textfile collector)
+
+    The file is replaced atomically, so the collector never reads half a report.
+    """
+
+    def __init__(self, path, prefix=PROMETHEUS_PREFIX):
+        self.path = path
+        self.prefix = prefix
+
+    def emit(self, report):
+        p = self.prefix
+        lines = []
+
+        def metric(name, kind, samples):
+            lines.append('# TYPE %s_%s %s' % (p, name, kind))
+            for labels, value in samples:
+                lines.append('%s_%s%s %s' % (p, name, _prometheus_labels(labels), repr(float(value))))
+
+        stages = report['stages'].items()
+        metric('stage_seconds', 'gauge', [({'stage': n}, s['seconds']) for n, s in stages])
+        metric('stage_elements', 'gauge', [({'stage': n}, s['elements']) for n, s in stages])
+        metric('stage_bytes_read', 'gauge', [({'stage': n}, s['bytes_read']) for n, s in stages])
+        metric('stage_bytes_written', 'gauge', [({'stage': n}, s['bytes_written']) for n, s in stages])
+        counters = OrderedDict()
+        for counter in report['counters']:
+            counters.setdefault(counter['name'], []).append((counter['labels'], counter['value']))
+        for name, samples in counters.items():
+            metric(name, 'gauge', samples)
+        metric('wall_seconds', 'gauge', [({}, report['wall_seconds'])])
+        if report['peak_rss_bytes'] is not None:
+            metric('peak_rss_bytes', 'gauge', [({}, report['peak_rss_bytes'])])
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Read OpenStreetMap PBF extracts (.osm.pbf) without any protobuf library.
+
+ A PBF file is a sequence of blobs: a 4 byte big-endian length, a BlobHeader
+ message ('OSMHeader' or 'OSMData') and a Blob holding the block, raw or
+ zlib/lzma compressed.  Reading and decompressing blobs runs in a background
+ thread (stream.prefetch) while the main thread decodes the PrimitiveBlocks
+ with the small protobuf wire format reader below.
+
+ pbf_elements() yields the same stream.Record objects as the expat backend,
+ with the attributes of the XML form, so shape_element() and the audits
+ cannot tell the two apart:
+
+   node     - id, lat, lon, user, uid, version, changeset, timestamp
+              children: tag (k, v)
+   way      - id, user, uid, version, changeset, timestamp
+              children: nd (ref), tag (k, v)
+   relation - id, user, uid, version, changeset, timestamp
+              children: member (type, ref, role), tag (k, v)
+
+ Coordinates are written out exactly from the file's nanodegree values and
+ timestamps as 2017-06-20T12:00:00Z.
+ '''
+
+import lzma
+import struct
+import time
+import zlib
+from itertools import accumulate
+
+from stream import Record, prefetch
+
+# features this reader understands; a file requiring anything else is refused
+SUPPORTED_FEATURES = {'OsmSchema-V0.6', 'DenseNodes'}
+
+MAX_BLOB_HEADER_SIZE = 64 * 1024
+MAX_BLOB_SIZE = 32 * 1024 * 1024
+
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+
+# ### Protobuf wire format
+
+def _varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def _signed(n):
+    """int32/int64 fields are varints of the 64 bit two's complement value"""
+    return n - (1 << 64) if n >= 1 << 63 else n
+
+
+def fields(buf):
+    """{field number: [values]} of a message; length-delimited values are bytes"""
+    message = {}
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _varint(buf, pos)
+        elif wire_type == 2:
+            size, pos = _varint(buf, pos)
+            value = buf[pos:pos + size]
+            pos += size
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("unsupported protobuf wire type %d" % wire_type)
+        message.setdefault(number, []).append(value)
+    return message
+
+
+def packed(message, number):
+    """Unsigned varints of a repeated field, packed or not"""
+    values = []
+    for value in message.get(number, ()):
+        if isinstance(value, int):
+            values.append(value)
+            continue
+        if not value or max(value) < 0x80:
+            # every varint is a single byte
+            values.extend(value)
+            continue
+        pos = 0
+        end = len(value)
+        while pos < end:
+            # inline single-byte varints, the common case in packed arrays
+            b = value[pos]
+            if b < 0x80:
+                values.append(b)
+                pos += 1
+            else:
+                n, pos = _varint(value, pos)
+                values.append(n)
+    return values
+
+
+def packed_sint(message, number):
+    return [_zigzag(n) for n in packed(message, number)]
+
+
+def _delta(values):
+    return list(accumulate(values))
+
+
+def _first(message, number, default=None):
+    values = message.get(number)
+    return values[0] if values else default
+
+
+# ### Blobs
+
+def read_blobs(f):
+    """Yield (type, block bytes) for every blob of an open PBF file, decompressed"""
+    while True:
+        head = f.read(4)
+        if not head:
+            return
+        if len(head) < 4:
+            raise ValueError("truncated PBF file")
+        size, = struct.unpack('>I', head)
+        if size > MAX_BLOB_HEADER_SIZE:
+            raise ValueError("BlobHeader of %d bytes exceeds the PBF limit" % size)
+        header = fields(f.read(size))
+        blob_type = header[1][0].decode('utf-8')
+        datasize = header[3][0]
+        if datasize > MAX_BLOB_SIZE:
+            raise ValueError("Blob of %d bytes exceeds the PBF limit" % datasize)
+        yield blob_type, decompress(fields(f.read(datasize)))
+
+
+def decompress(blob):
+    if 1 in blob:
+        return blob[1][0]
+    if 3 in blob:
+        return zlib.decompress(blob[3][0])
+    if 4 in blob:
+        return lzma.decompress(blob[4][0])
+    raise ValueError("unsupported PBF blob compression (fields %s)" % sorted(blob))
+
+
+def check_header(block):
+    header = fields(block)
+    required = {value.decode('utf-8') for value in header.get(4, ())}
+    unsupported = required - SUPPORTED_FEATURES
+    if unsupported:
+        raise ValueError("PBF file requires unsupported features: %s" % ', '.join(sorted(unsupported)))
+
+
+# ### Primitive blocks
+
+def _coordinate(offset, granularity, value):
+    """Exact decimal degrees of a PBF coordinate, as in the XML form"""
+    # nanodegrees fit a double exactly and '%.9f' rounds back to the same digits
+    return ('%.9f' % ((offset + granularity * value) / 1e9)).rstrip('0').rstrip('.')
+
+
+class Block(object):
+    """Decoding context of one PrimitiveBlock: strings, granularity and offsets"""
+
+    def __init__(self, data):
+        block = fields(data)
+        self.strings = [s.decode('utf-8') for s in fields(block[1][0]).get(1, ())] if 1 in block else []
+        self.groups = block.get(2, ())
+        self.granularity = _first(block, 17, 100)
+        self.lat_offset = _signed(_first(block, 19, 0))
+        self.lon_offset = _signed(_first(block, 20, 0))
+        self.date_granularity = _first(block, 18, 1000)
+        self._timestamps = {}
+
+    def timestamp(self, value):
+        stamp = self._timestamps.get(value)
+        if stamp is None:
+            stamp = self._timestamps[value] = time.strftime(
+                '%Y-%m-%dT%H:%M:%SZ', time.gmtime(value * self.date_granularity // 1000))
+        return stamp
+
+    def info(self, attrib, message):
+        """Add the Info message (field 4) of a node, way or relation to attrib"""
+        if 4 not in message:
+            return
+        info = fields(message[4][0])
+        if 1 in info:
+            attrib['version'] = str(_signed(info[1][0]))
+        if 2 in info:
+            attrib['timestamp'] = self.timestamp(_signed(info[2][0]))
+        if 3 in info:
+            attrib['changeset'] = str(_signed(info[3][0]))
+        if 4 in info:
+            attrib['uid'] = str(_signed(info[4][0]))
+        if 5 in info:
+            attrib['user'] = self.strings[info[5][0]]
+
+    def tags(self, message):
+        strings = self.strings
+        return [Record('tag', {'k': strings[k], 'v': strings[v]})
+                for k, v in zip(packed(message, 2), packed(message, 3))]
+
+    def nodes(self, group):
+        for data in group.get(1, ()):
+            message = fields(data)
+            attrib = {'id': str(_zigzag(message[1][0])),
+                      'lat': _coordinate(self.lat_offset, self.granularity, _zigzag(message[8][0])),
+                      'lon': _coordinate(self.lon_offset, self.granularity, _zigzag(message[9][0]))}
+            self.info(attrib, message)
+            yield Record('node', attrib, self.tags(message))
+
+    def dense_nodes(self, group):
+        strings = self.strings
+        for data in group.get(2, ()):
+            dense = fields(data)
+            ids = _delta(packed_sint(dense, 1))
+            lats = _delta(packed_sint(dense, 8))
+            lons = _delta(packed_sint(dense, 9))
+            keys_vals = packed(dense, 10)
+
+            versions = timestamps = changesets = uids = user_sids = None
+            if 5 in dense:
+                info = fields(dense[5][0])
+                versions = packed(info, 1)
+                timestamps = _delta(packed_sint(info, 2))
+                changesets = _delta(packed_sint(info, 3))
+                uids = _delta(packed_sint(info, 4))
+                user_sids = _delta(packed_sint(info, 5))
+
+            kv = 0
+            for i, node_id in enumerate(ids):
+                attrib = {'id': str(node_id),
+                          'lat': _coordinate(self.lat_offset, self.granularity, lats[i]),
+                          'lon': _coordinate(self.lon_offset, self.granularity, lons[i])}
+                if versions is not None:
+                    attrib['version'] = str(versions[i])
+                    attrib['timestamp'] = self.timestamp(timestamps[i])
+                    attrib['changeset'] = str(changesets[i])
+                    attrib['uid'] = str(uids[i])
+                    attrib['user'] = strings[user_sids[i]]
+
+                tags = []
+                if keys_vals:
+                    while keys_vals[kv]:
+                        tags.append(Record('tag', {'k': strings[keys_vals[kv]], 'v': strings[keys_vals[kv + 1]]}))
+                        kv += 2
+                    kv += 1
+                yield Record('node', attrib, tags)
+
+    def ways(self, group):
+        for data in group.get(3, ()):
+            message = fields(data)
+            attrib = {'id': str(_signed(message[1][0]))}
+            self.info(attrib, message)
+            children = [Record('nd', {'ref': str(ref)}) for ref in _delta(packed_sint(message, 8))]
+            children.extend(self.tags(message))
+            yield Record('way', attrib, children)
+
+    def relations(self, group):
+        strings = self.strings
+        for data in group.get(4, ()):
+            message = fields(data)
+            attrib = {'id': str(_signed(message[1][0]))}
+            self.info(attrib, message)
+            roles = packed(message, 8)
+            refs = _delta(packed_sint(message, 9))
+            types = packed(message, 10)
+            children = [Record('member', {'type': MEMBER_TYPES[t], 'ref': str(ref), 'role': strings[role]})
+                        for role, ref, t in zip(roles, refs, types)]
+            children.extend(self.tags(message))
+            yield Record('relation', attrib, children)
+
+
+def pbf_elements(osm_file, tags=MEMBER_TYPES):
+    """Yield a Record for every node, way and relation of a PBF file whose tag is in tags"""
+    tags = frozenset(tags)
+    with open(osm_file, 'rb') as f:
+        blobs = prefetch(read_blobs(f))
+        try:
+            for blob_type, data in blobs:
+                if blob_type == 'OSMHeader':
+                    check_header(data)
+                    continue
+                if blob_type != 'OSMData':
+                    continue
+                block = Block(data)
+                for group_data in block.groups:
+                    group = fields(group_data)
+                    if 'node' in tags:
+                        yield from block.nodes(group)
+                        yield from block.dense_nodes(group)
+                    if 'way' in tags:
+                        yield from block.ways(group)
+                    if 'relation' in tags:
+                        yield from block.relations(group)
+        finally:
+            # stop the reader thread before the file is closed
+            blobs.close()
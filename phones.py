@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Normalize phone numbers to E.164 (+13129209100).
+
+ The phone audit left these formats unsolved:
+
+   +1-312-372-0072, (312) 920-9100, (312)-1116, 888-642-6674, +13122650580,
+   +1 (312) 475-1390, 7732482570, 8 800 775-52-93, 800 DL MOODY
+
+ normalize_phone() strips punctuation, maps vanity letters to keypad digits
+ (800 DL MOODY -> +18003566639), keeps an extension as " ext. 123" and
+ reads 10 digit and 1 + 10 digit numbers as North American.  Values it
+ cannot read with confidence ((312)-1116, 8 800 775-52-93) give None and
+ clean_phone() leaves them unchanged.  Several numbers in one OSM value
+ (separated by ';') are normalized one by one.
+
+ normalize_phones() is the batch form for a whole column: values are
+ deduplicated and each distinct value is normalized once.  backfill_sqlite()
+ and backfill_csv() apply it to already loaded phone tags; in SQLite the
+ distinct values go into a temporary mapping table and each tag table is
+ fixed with a single UPDATE ... FROM (SQLite 3.33+).  all_tags is fixed the
+ same way, which also refreshes all_tags_fts through its update trigger.
+ '''
+
+import csv
+import os
+import re
+import sqlite3
+
+DEFAULT_COUNTRY_CODE = '1'
+
+KEYPAD = str.maketrans(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+    '22233344455566677778889999')
+
+EXTENSION_RE = re.compile(r'\s*(?:ext\.?|extension|x|#)\s*(\d{1,6})\s*$', re.IGNORECASE)
+PHONE_CHARS_RE = re.compile(r'^[+\d\sA-Za-z().\-/]+$')
+NOT_DIGIT_RE = re.compile(r'\D')
+
+# tag keys holding phone numbers once shaped ('contact:phone' -> key 'phone', type 'contact')
+PHONE_KEYS = ('phone',)
+
+
+def normalize_phone(value, country_code=DEFAULT_COUNTRY_CODE):
+    """E.164 form of a single phone number, or None if it cannot be read"""
+    value = value.strip()
+    extension = ''
+    m = EXTENSION_RE.search(value)
+    if m:
+        extension = ' ext. ' + m.group(1)
+        value = value[:m.start()]
+
+    if not value or not PHONE_CHARS_RE.match(value):
+        return None
+
+    international = value.startswith('+')
+    first_letter = next((i for i, c in enumerate(value) if c.isalpha()), None)
+    if first_letter is not None:
+        # vanity numbers: at most 7 letters, after at least the area code
+        letters = sum(c.isalpha() for c in value)
+        if letters > 7 or len(NOT_DIGIT_RE.sub('', value[:first_letter])) < 3:
+            return None
+        value = value.upper().translate(KEYPAD)
+
+    digits = NOT_DIGIT_RE.sub('', value)
+    if international:
+        if not 8 <= len(digits) <= 15:
+            return None
+        if digits.startswith('1') and len(digits) != 11:
+            return None
+        return '+' + digits + extension
+    if digits.startswith('00') and 10 <= len(digits) <= 17:
+        return '+' + digits[2:] + extension
+
+    if country_code == '1':
+        if len(digits) == 11 and digits[0] == '1':
+            digits = digits[1:]
+        if len(digits) == 10 and digits[0] in '23456789':
+            return '+1' + digits + extension
+    return None
+
+
+def clean_phone(value):
+    """Normalize every ';' separated number in value, keeping any that can't be read"""
+    parts = []
+    for part in value.split(';'):
+        normalized = normalize_phone(part)
+        parts.append(normalized if normalized is not None else part)
+    return ';'.join(parts)
+
+
+def normalize_phones(values):
+    """clean_phone() over a whole column, normalizing each distinct value once"""
+    fixed = {value: clean_phone(value) for value in set(values)}
+    return [fixed[value] for value in values]
+
+
+def backfill_sqlite(db_path, tables=('nodes_tags', 'ways_tags', 'relations_tags', 'all_tags'), keys=PHONE_KEYS):
+    """Rewrite the phone tags already in db_path; return the rows changed per table
+
+    Tables missing from db_path (all_tags before database.finish_load()) are skipped.
+    """
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    marks = ', '.join('?' * len(keys))
+    changed = {}
+    try:
+        cur.execute('CREATE TEMP TABLE phone_fix (old TEXT PRIMARY KEY, new TEXT NOT NULL)')
+        for table in tables:
+            if cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                           (table,)).fetchone() is None:
+                continue
+            cur.execute('DELETE FROM phone_fix')
+            values = [row[0] for row in cur.execute(
+                'SELECT DISTINCT value FROM {0} WHERE key IN ({1})'.format(table, marks), keys)]
+            cur.executemany('INSERT INTO phone_fix (old, new) VALUES (?, ?)',
+                            [(old, new) for old, new in zip(values, normalize_phones(values)) if old != new])
+            cur.execute('''
+                UPDATE {0} SET value = phone_fix.new
+                FROM phone_fix
+                WHERE {0}.value = phone_fix.old AND {0}.key IN ({1})'''.format(table, marks), keys)
+            changed[table] = cur.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return changed
+
+
+def backfill_csv(path, keys=PHONE_KEYS):
+    """Rewrite the phone values of a tags CSV (nodes_tags.csv, ways_tags.csv) in place"""
+    fixed = {}
+    changed = 0
+    tmp_path = path + '.tmp'
+    with open(path, 'r', encoding='utf-8', newline='') as fin, \
+         open(tmp_path, 'w', encoding='utf-8', newline='') as fout:
+        reader = csv.reader(fin)
+        writer = csv.writer(fout)
+        header = next(reader)
+        writer.writerow(header)
+        key_i, value_i = header.index('key'), header.index('value')
+
+        for row in reader:
+            if row[key_i] in keys:
+                value = row[value_i]
+                new = fixed.get(value)
+                if new is None:
+                    new = fixed[value] = clean_phone(value)
+                if new != value:
+                    row[value_i] = new
+                    changed += 1
+            writer.writerow(row)
+
+    os.replace(tmp_path, path)
+    return changed
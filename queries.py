@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ The exploration queries from the notebook, by name.
+
+ The tag questions read all_tags (built by database.finish_load()) instead
+ of scanning nodes_tags UNION ALL ways_tags.  When the database has the
+ all_tags_fts full-text index, the LIKE '%...%' / 'prefix%' questions use
+ FTS_QUERIES instead, which find the matching rows through the index.
+ The headline counts (users, nodes, ways, node types, top contributors,
+ cuisines, amenities, religions) are read from the summary tables written at
+ load time (summary.py) through SUMMARY_QUERIES when they exist.
+
+ query() and iter_query() run any named query, with parameters for the
+ PARAM_QUERIES, over a read-only connection that each thread opens once per
+ database and reuses.  iter_query() streams rows off the cursor; query()
+ materializes them and keeps them in an LRU cache keyed on the query, its
+ parameters and the database generation (the file's inode, size and mtime),
+ so repeated dashboard refreshes are answered without touching SQLite until
+ the database is reloaded or changed.
+
+ tags_in_box() and tags_near() answer "elements with tag X inside this
+ box / within this radius" through the R*Tree indexes nodes_rtree and
+ ways_rtree built at load time: the index finds the candidate elements and
+ only their tags are read.  Ways are matched by their bounding box.
+ '''
+
+import math
+import os
+import pprint
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+DB_PATH = 'chicago.db'
+
+QUERIES = {
+    'unique_users': "SELECT COUNT(DISTINCT(u.uid))FROM (SELECT uid FROM Nodes UNION ALL SELECT uid FROM Ways) as u;",
+    'nodes': "SELECT count(DISTINCT(id)) FROM nodes;",
+    'ways': "SELECT count(DISTINCT(id)) FROM ways;",
+    'node_types': "SELECT type , count(*) as num  FROM nodes_tags group by type order by num desc;",
+    'cafes': "SELECT value, count(*) FROM all_tags where value like '%cafe%';",
+    'top_users': "select u.user, count(*) as num from (select user from nodes UNION ALL select user from ways) as u group by user order by num desc limit 10;",
+    'cuisines': "select value,count(*) as num from all_tags where key like '%cuisine%' group by value order by num desc limit 20;",
+    'websites': "select value, count(*) as num from all_tags WHERE value LIKE '%www.%' group by value order by num desc limit 100;",
+    'amenities': "select value, count(*) as num from nodes_tags where key='amenity' group by value order by num desc limit 20;",
+    'jewel_osco': "select value, count(*) as num from all_tags WHERE value like 'Jewel-Osco%' group by value order by num desc;",
+    'museums': "select value, count(*) as num from all_tags WHERE value like '%museum%' and value not like 'en%' and value not like 'http++' group by value order by num desc;",
+    'religion': "select value, count(*) as num from all_tags where key='religion' group by value order by num desc;",
+    'denominations': "SELECT b.value, COUNT(*) as num FROM ways_tags JOIN (SELECT DISTINCT(id) FROM ways_tags WHERE value='place_of_worship') a ON ways_tags.id=a.id JOIN (SELECT DISTINCT(id), value FROM ways_tags WHERE key = 'denomination') b ON a.id = b.id WHERE ways_tags.key='religion' AND ways_tags.value = 'christian' GROUP BY b.value ORDER BY num DESC;",
+    'phones': "SELECT value FROM all_tags WHERE key='phone';",
+}
+
+# named parameterized queries; parameters missing from a call take DEFAULT_PARAMS
+PARAM_QUERIES = {
+    'tag_values': "select value, count(*) as num from all_tags where key = :key group by value order by num desc limit :limit;",
+    'values_like': "select value, count(*) as num from all_tags where value like :pattern group by value order by num desc limit :limit;",
+    'element_tags': "select key, value, type from all_tags where element_type = :element_type and id = :id;",
+    'user_edits': "select count(*) from (select id from nodes where user = :user UNION ALL select id from ways where user = :user);",
+    'way_nodes': "select node_id from ways_nodes where id = :id order by position;",
+    'relation_members': "select member_type, member_id, role from relations_members where id = :id order by position;",
+    'member_relations': "select id, role from relations_members where member_type = :element_type and member_id = :id;",
+    'relations_tagged': "select id, value from relations_tags where key = :key and value like :value;",
+    # (element_type, id, key, value, min_lat, max_lat, min_lon, max_lon) of the
+    # tags (key = :key, value LIKE :value) of nodes inside / ways overlapping a box
+    'tags_in_box': '''
+        SELECT 'node', t.id, t.key, t.value, n.lat, n.lat, n.lon, n.lon
+        FROM nodes_rtree r
+        JOIN nodes n ON n.id = r.id
+        JOIN all_tags t ON t.element_type = 'node' AND t.id = r.id
+        WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat
+          AND r.max_lon >= :min_lon AND r.min_lon <= :max_lon
+          AND n.lat BETWEEN :min_lat AND :max_lat AND n.lon BETWEEN :min_lon AND :max_lon
+          AND (:key IS NULL OR t.key = :key) AND t.value LIKE :value
+        UNION ALL
+        SELECT 'way', t.id, t.key, t.value, r.min_lat, r.max_lat, r.min_lon, r.max_lon
+        FROM ways_rtree r
+        JOIN all_tags t ON t.element_type = 'way' AND t.id = r.id
+        WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat
+          AND r.max_lon >= :min_lon AND r.min_lon <= :max_lon
+          AND (:key IS NULL OR t.key = :key) AND t.value LIKE :value;''',
+}
+
+# LIMIT -1 is no limit in SQLite; key None and value '%' match every tag
+DEFAULT_PARAMS = {'limit': -1, 'key': None, 'value': '%'}
+
+EARTH_RADIUS = 6371008.8  # metres
+METRES_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+# rows of all_tags whose value matches a LIKE pattern, found through all_tags_fts
+FTS_MATCH = "rowid IN (SELECT rowid FROM all_tags_fts WHERE value LIKE {0})"
+
+FTS_QUERIES = {
+    'cafes': "SELECT value, count(*) FROM all_tags WHERE " + FTS_MATCH.format("'%cafe%'") + ";",
+    'websites': "select value, count(*) as num from all_tags WHERE " + FTS_MATCH.format("'%www.%'") + " group by value order by num desc limit 100;",
+    'jewel_osco': "select value, count(*) as num from all_tags WHERE " + FTS_MATCH.format("'Jewel-Osco%'") + " group by value order by num desc;",
+    'museums': "select value, count(*) as num from all_tags WHERE " + FTS_MATCH.format("'%museum%'") + " and value not like 'en%' and value not like 'http++' group by value order by num desc;",
+    'values_like': "select value, count(*) as num from all_tags WHERE " + FTS_MATCH.format(":pattern") + " group by value order by num desc limit :limit;",
+}
+
+# the same answers from the precomputed summary tables
+SUMMARY_TOP = "SELECT value, num FROM summary_counters WHERE category = '{0}' ORDER BY num DESC{1};"
+
+SUMMARY_QUERIES = {
+    'unique_users': "SELECT value FROM summary_totals WHERE name = 'unique_users';",
+    'nodes': "SELECT value FROM summary_totals WHERE name = 'nodes';",
+    'ways': "SELECT value FROM summary_totals WHERE name = 'ways';",
+    'node_types': SUMMARY_TOP.format('node_types', ''),
+    'top_users': SUMMARY_TOP.format('users', ' LIMIT 10'),
+    'cuisines': SUMMARY_TOP.format('cuisines', ' LIMIT 20'),
+    'amenities': SUMMARY_TOP.format('amenities', ' LIMIT 20'),
+    'religion': SUMMARY_TOP.format('religions', ''),
+}
+
+
+def has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+
+def has_full_text(conn):
+    return has_table(conn, 'all_tags_fts')
+
+
+def query_sql(name, conn):
+    """SQL for a named query, from the summary tables or all_tags_fts when conn has them"""
+    if name in SUMMARY_QUERIES and has_table(conn, 'summary_totals'):
+        return SUMMARY_QUERIES[name]
+    if name in FTS_QUERIES and has_full_text(conn):
+        return FTS_QUERIES[name]
+    if name in PARAM_QUERIES:
+        return PARAM_QUERIES[name]
+    return QUERIES[name]
+
+
+def search_tags(conn, pattern, key=None, limit=None):
+    """all_tags rows (element_type, id, key, value, type) whose value is LIKE pattern
+
+    Substring ('%cafe%') and prefix ('Jewel-Osco%') patterns are answered by
+    all_tags_fts when it exists; patterns of fewer than three characters,
+    or databases without the index, fall back to scanning all_tags.
+    """
+    sql = "SELECT element_type, id, key, value, type FROM all_tags WHERE "
+    if has_full_text(conn):
+        sql += FTS_MATCH.format('?')
+    else:
+        sql += "value LIKE ?"
+    params = [pattern]
+    if key is not None:
+        sql += " AND key = ?"
+        params.append(key)
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+# ### Connection reuse and result caching
+
+CACHE_SIZE = 256
+
+_local = threading.local()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def generation(db_path=DB_PATH):
+    """Changes whenever db_path is rewritten, reloaded or replaced"""
+    st = os.stat(db_path)
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def connect(db_path=DB_PATH):
+    """This thread's read-only connection to db_path, opened on first use
+
+    The connection is reopened if db_path has been replaced by a new file
+    (a fresh load). Returns (connection, generation).
+    """
+    gen = generation(db_path)
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    entry = connections.get(db_path)
+    if entry is None or entry[1] != gen[0]:
+        if entry is not None:
+            entry[0].close()
+        uri = Path(db_path).resolve().as_uri() + '?mode=ro'
+        entry = connections[db_path] = (sqlite3.connect(uri, uri=True), gen[0])
+    return entry[0], gen
+
+
+def close_connections():
+    """Close this thread's pooled connections"""
+    for conn, _ in getattr(_local, 'connections', {}).values():
+        conn.close()
+    _local.connections = {}
+
+
+def bind(name, params):
+    return dict(DEFAULT_PARAMS, **params) if name in PARAM_QUERIES else ()
+
+
+def iter_query(name, db_path=DB_PATH, **params):
+    """Stream the rows of a named query off the cursor, uncached"""
+    conn, _ = connect(db_path)
+    return conn.execute(query_sql(name, conn), bind(name, params))
+
+
+def query(name, db_path=DB_PATH, **params):
+    """Rows (a tuple) of a named query, cached until the database changes"""
+    conn, gen = connect(db_path)
+    key = (os.path.abspath(db_path), name, tuple(sorted(params.items())))
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] == gen:
+            _cache.move_to_end(key)
+            return hit[1]
+
+    rows = tuple(conn.execute(query_sql(name, conn), bind(name, params)))
+    with _cache_lock:
+        _cache[key] = (gen, rows)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return rows
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+# ### Spatial queries
+
+def tags_in_box(min_lat, min_lon, max_lat, max_lon, key=None, value='%', db_path=DB_PATH):
+    """Tags (key, value LIKE pattern) of the nodes inside and the ways overlapping a box
+
+    Rows are (element_type, id, key, value, min_lat, max_lat, min_lon, max_lon);
+    a node's box is its point.
+    """
+    return query('tags_in_box', db_path, min_lat=min_lat, min_lon=min_lon, max_lat=max_lat,
+                 max_lon=max_lon, key=key, value=value)
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """Great circle distance in metres (haversine)"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def tags_near(lat, lon, radius, key=None, value='%', db_path=DB_PATH):
+    """Tags of the elements within radius metres of (lat, lon), nearest first
+
+    The R*Tree is probed with the box around the circle and the candidates
+    are filtered by exact distance (for a way, to the nearest point of its
+    bounding box).  Rows are (distance, element_type, id, key, value).
+    """
+    dlat = radius / METRES_PER_DEGREE
+    dlon = radius / (METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+    near = []
+    for element_type, element_id, k, v, min_lat, max_lat, min_lon, max_lon in tags_in_box(
+            lat - dlat, lon - dlon, lat + dlat, lon + dlon, key, value, db_path):
+        d = distance(lat, lon, min(max(lat, min_lat), max_lat), min(max(lon, min_lon), max_lon))
+        if d <= radius:
+            near.append((d, element_type, element_id, k, v))
+    near.sort()
+    return near
+
+
+def run_query(name, db_path=DB_PATH, **params):
+    rows = query(name, db_path, **params)
+    pprint.pprint(rows)
+    return rows
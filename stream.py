@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Memory-bounded streaming over an OSM XML file.
+
+ ElementTree's iterparse keeps every parsed element attached to the root, so
+ an audit that never clears ends up holding the whole tree.  iter_elements()
+ clears the root after each of its children (node, way, relation, bounds...)
+ has been handed out, which keeps memory proportional to the largest single
+ element instead of the file size.  Every audit goes through it.
+
+ get_element() picks one of several parser backends (PARSERS):
+   'lxml'  - lxml's iterparse with tag filtering, when lxml is installed
+   'expat' - a SAX-style expat handler that emits lightweight Record
+             objects (no Element tree at all)
+   'etree' - xml.etree.ElementTree.iterparse, always available
+ 'auto' (the default) uses lxml when it is installed and etree otherwise.
+ All of them yield objects with the .tag / .get() / iteration interface
+ shape_element() uses.
+
+ Compressed extracts (.osm.gz, .osm.bz2, .osm.xz, recognised by their magic
+ bytes) are read through open_osm(), which decompresses in a background
+ thread a few READ_SIZE chunks ahead of the parser; zlib, bz2 and lzma
+ release the GIL, so decompression overlaps with parsing.  .osm.pbf files
+ are decoded by pbf.pbf_elements() into the same Record objects, whatever
+ parser is asked for.  iter_elements() (the audits) accepts all of them.
+ '''
+
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+import xml.etree.ElementTree as ET
+from functools import partial
+from xml.parsers import expat
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+TOP_LEVEL_TAGS = ('node', 'way', 'relation')
+
+PARSER = 'auto'
+
+READ_SIZE = 1 << 20
+
+# chunks (or PBF blocks) decompressed ahead of the parser
+PREFETCH_DEPTH = 8
+
+# (format, leading bytes, opener) of each compressed format
+COMPRESSED = [
+    ('gzip', b'\x1f\x8b', gzip.open),
+    ('bz2', b'BZh', bz2.open),
+    ('xz', b'\xfd7zXZ\x00', lzma.open),
+]
+
+
+def file_format(osm_file):
+    """'gzip', 'bz2', 'xz', 'pbf' or 'xml' for a path (file objects are taken as XML)"""
+    if hasattr(osm_file, 'read'):
+        return 'xml'
+    with open(osm_file, 'rb') as f:
+        head = f.read(16)
+    for fmt, magic, _ in COMPRESSED:
+        if head.startswith(magic):
+            return fmt
+    # a PBF file starts with the length and BlobHeader of its OSMHeader block
+    if head[6:15] == b'OSMHeader':
+        return 'pbf'
+    return 'xml'
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(iterable, depth=PREFETCH_DEPTH):
+    """Iterate over iterable in a background thread, up to depth items ahead"""
+    items = queue.Queue(depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fill():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except BaseException as e:
+            put(_Failure(e))
+
+    thread = threading.Thread(target=fill, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class PrefetchReader(object):
+    """Binary file-like object over a raw file read (and decompressed) in a background thread"""
+
+    def __init__(self, raw, chunk_size=READ_SIZE, depth=PREFETCH_DEPTH):
+        self.raw = raw
+        self.chunks = prefetch(iter(partial(raw.read, chunk_size), b''), depth)
+        self.buffer = bytearray()
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof and (size is None or size < 0 or len(self.buffer) < size):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+            else:
+                self.buffer += chunk
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def close(self):
+        self.chunks.close()
+        self.raw.close()
+
+
+def open_osm(osm_file, threaded=True):
+    """Binary file object over osm_file, decompressing gzip, bz2 and xz on the fly"""
+    fmt = file_format(osm_file)
+    for name, _, opener in COMPRESSED:
+        if name == fmt:
+            raw = opener(osm_file, 'rb')
+            return PrefetchReader(raw) if threaded else raw
+    return open(osm_file, 'rb')
+
+
+def iter_elements(osm_file):
+    """Yield (element, parent tag) for every element at its end event
+
+    parent is the tag of the enclosing top level element ('node', 'way',
+    'relation', ...) or None for the top level elements and the root.
+    Children are yielded before their parent; once a top level element has
+    been yielded the root is cleared, so callers must not keep references to
+    elements beyond the current top level element.  Compressed and PBF
+    files are read through open_osm() and pbf_elements().
+    """
+    fmt = file_format(osm_file)
+    if fmt == 'pbf':
+        yield from _pbf_iter_elements(osm_file)
+        return
+    if fmt == 'xml':
+        yield from _iter_elements(osm_file)
+        return
+    source = open_osm(osm_file)
+    try:
+        yield from _iter_elements(source)
+    finally:
+        source.close()
+
+
+def _pbf_iter_elements(osm_file):
+    # a PBF file has no <osm> root or <bounds>; only nodes, ways, relations and their children
+    from pbf import pbf_elements
+    for record in pbf_elements(osm_file, TOP_LEVEL_TAGS):
+        for child in record:
+            yield child, record.tag
+        yield record, None
+
+
+def _iter_elements(osm_file):
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    depth = 1
+    parent = None
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            if depth == 2:
+                parent = elem.tag
+            continue
+
+        depth -= 1
+        if depth == 1:
+            yield elem, None
+            root.clear()
+            parent = None
+        elif depth == 0:
+            yield elem, None
+        else:
+            yield elem, parent
+
+
+def etree_elements(osm_file, tags):
+    for elem, parent in iter_elements(osm_file):
+        if parent is None and elem.tag in tags:
+            yield elem
+
+
+def lxml_elements(osm_file, tags):
+    for _, elem in lxml_etree.iterparse(osm_file, events=('end',), tag=tags):
+        yield elem
+        # drop the element and every sibling parsed before it
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+class Record(object):
+    """Lightweight stand-in for an Element: tag, attrib dict and child records"""
+
+    __slots__ = ('tag', 'attrib', 'children')
+
+    def __init__(self, tag, attrib, children=()):
+        self.tag = tag
+        self.attrib = attrib
+        self.children = children
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+
+class RecordHandler(object):
+    """expat callbacks building a Record per wanted top level element"""
+
+    def __init__(self, tags):
+        self.tags = frozenset(tags)
+        self.depth = 0
+        self.current = None
+        self.done = []
+
+    def start(self, name, attrs):
+        self.depth += 1
+        if self.depth == 3:
+            if self.current is not None:
+                self.current.children.append(Record(name, attrs))
+        elif self.depth == 2:
+            self.current = Record(name, attrs, []) if name in self.tags else None
+
+    def end(self, name):
+        if self.depth == 2 and self.current is not None:
+            self.done.append(self.current)
+            self.current = None
+        self.depth -= 1
+
+
+def expat_elements(osm_file, tags):
+    handler = RecordHandler(tags)
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+
+    osm = osm_file if hasattr(osm_file, 'read') else open(osm_file, 'rb')
+    try:
+        while True:
+            data = osm.read(READ_SIZE)
+            parser.Parse(data, not data)
+            if handler.done:
+                for record in handler.done:
+                    yield record
+                del handler.done[:]
+            if not data:
+                break
+    finally:
+        if osm is not osm_file:
+            osm.close()
+
+
+PARSERS = {
+    'etree': etree_elements,
+    'lxml': lxml_elements,
+    'expat': expat_elements,
+}
+
+
+def get_parser(parser=None):
+    """Resolve a parser name ('auto', 'lxml', 'expat', 'etree') to its element generator"""
+    parser = parser or PARSER
+    if parser == 'auto':
+        parser = 'lxml' if lxml_etree is not None else 'etree'
+    if parser == 'lxml' and lxml_etree is None:
+        raise ImportError("the 'lxml' parser requires lxml (pip install lxml)")
+    return PARSERS[parser]
+
+
+def get_element(osm_file, tags=TOP_LEVEL_TAGS, parser=None):
+    """Yield element if it is the right type of tag"""
+    fmt = file_format(osm_file)
+    if fmt == 'pbf':
+        from pbf import pbf_elements
+        return pbf_elements(osm_file, tuple(tags))
+    if fmt != 'xml':
+        return _compressed_elements(get_parser(parser), osm_file, tuple(tags))
+    return get_parser(parser)(osm_file, tuple(tags))
+
+
+def _compressed_elements(backend, osm_file, tags):
+    source = open_osm(osm_file)
+    try:
+        yield from backend(source, tags)
+    finally:
+        source.close()
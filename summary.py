@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Headline statistics of the dataset, counted while elements are shaped.
+
+ Summary keeps a Counter per category (elements, users, uids, node types,
+ amenities, cuisines, religions) and is fed every shaped element by
+ data.process_map() and database.load_osm(), so the notebook's headline
+ numbers cost nothing extra to compute.  save() persists the counters to
+ summary_counters and the totals to summary_totals, where dashboards read
+ them directly:
+
+   SELECT value FROM summary_totals WHERE name = 'unique_users'
+   SELECT value, num FROM summary_counters WHERE category = 'cuisines'
+       ORDER BY num DESC LIMIT 10
+
+ changes.apply_changes() subtracts the stored version of each changed
+ element and adds the new one, so the summary stays current without
+ re-aggregating the database.
+
+ Relation tags count towards cuisines and religions, as all_tags includes
+ relations_tags; the user statistics cover nodes and ways, as the notebook's
+ queries do.
+ '''
+
+import json
+from collections import Counter
+
+SUMMARY_PATH = 'summary.json'
+
+CATEGORIES = ('elements', 'users', 'uids', 'node_types', 'amenities', 'cuisines', 'religions')
+
+CREATE_SUMMARY_COUNTERS = '''
+CREATE TABLE summary_counters (
+    category TEXT NOT NULL,
+    value TEXT NOT NULL,
+    num INTEGER NOT NULL,
+    PRIMARY KEY (category, value)
+)'''
+
+CREATE_SUMMARY_TOTALS = '''
+CREATE TABLE summary_totals (
+    name TEXT PRIMARY KEY NOT NULL,
+    value INTEGER NOT NULL
+)'''
+
+
+class Summary(object):
+    """Counters behind the notebook's headline statistics"""
+
+    def __init__(self):
+        self.counters = {category: Counter() for category in CATEGORIES}
+
+    def add(self, el, sign=1):
+        """Count a shaped element (sign=-1 takes it back out)"""
+        for element_type in ('node', 'way', 'relation'):
+            if element_type in el:
+                break
+        attribs = el[element_type]
+        tags = [(None, tag['key'], tag['value'], tag['type']) for tag in el.get(element_type + '_tags', ())]
+        self.add_record(element_type, attribs.get('user'), attribs.get('uid'), tags, sign)
+
+    def add_record(self, element_type, user, uid, tags, sign=1):
+        """Count an element from its user, uid and (id, key, value, type) tag rows"""
+        counters = self.counters
+        counters['elements'][element_type] += sign
+        if element_type != 'relation':
+            counters['users'][user] += sign
+            counters['uids'][str(uid)] += sign
+
+        for _, key, value, tag_type in tags:
+            if element_type == 'node':
+                counters['node_types'][tag_type] += sign
+                if key == 'amenity':
+                    counters['amenities'][value] += sign
+            if 'cuisine' in key:
+                counters['cuisines'][value] += sign
+            if key == 'religion':
+                counters['religions'][value] += sign
+
+    def merge(self, other):
+        for category, counter in other.counters.items():
+            self.counters[category].update(counter)
+        return self
+
+    def totals(self):
+        uids = self.counters['uids']
+        return {
+            'nodes': self.counters['elements']['node'],
+            'ways': self.counters['elements']['way'],
+            'relations': self.counters['elements']['relation'],
+            'unique_users': sum(1 for num in uids.values() if num > 0),
+        }
+
+    def top(self, category, n=10):
+        return [(value, num) for value, num in self.counters[category].most_common(n) if num > 0]
+
+    def save(self, cur):
+        """Replace summary_counters and summary_totals with this summary"""
+        cur.execute('DROP TABLE IF EXISTS summary_counters')
+        cur.execute('DROP TABLE IF EXISTS summary_totals')
+        cur.execute(CREATE_SUMMARY_COUNTERS)
+        cur.execute(CREATE_SUMMARY_TOTALS)
+        cur.executemany('INSERT INTO summary_counters (category, value, num) VALUES (?, ?, ?)',
+                        [(category, value, num)
+                         for category, counter in self.counters.items()
+                         for value, num in counter.items() if num > 0])
+        cur.executemany('INSERT INTO summary_totals (name, value) VALUES (?, ?)',
+                        sorted(self.totals().items()))
+
+    @classmethod
+    def load(cls, cur):
+        """Summary stored by save(), or None if the database has none"""
+        if cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'summary_counters'").fetchone() is None:
+            return None
+        summary = cls()
+        for category, value, num in cur.execute('SELECT category, value, num FROM summary_counters'):
+            summary.counters[category][value] = num
+        return summary
+
+    @classmethod
+    def from_db(cls, cur):
+        """Aggregate a summary from the loaded tables (when none was counted while loading)"""
+        summary = cls()
+        counters = summary.counters
+        for element_type, table in (('node', 'nodes'), ('way', 'ways')):
+            for user, uid, num in cur.execute(
+                    'SELECT user, uid, count(*) FROM {0} GROUP BY user, uid'.format(table)):
+                counters['elements'][element_type] += num
+                counters['users'][user] += num
+                counters['uids'][str(uid)] += num
+        counters['elements']['relation'] += cur.execute('SELECT count(*) FROM relations').fetchone()[0]
+        for tag_type, num in cur.execute('SELECT type, count(*) FROM nodes_tags GROUP BY type'):
+            counters['node_types'][tag_type] += num
+        for value, num in cur.execute("SELECT value, count(*) FROM nodes_tags WHERE key = 'amenity' GROUP BY value"):
+            counters['amenities'][value] += num
+        for table in ('nodes_tags', 'ways_tags', 'relations_tags'):
+            for value, num in cur.execute(
+                    "SELECT value, count(*) FROM {0} WHERE key LIKE '%cuisine%' GROUP BY value".format(table)):
+                counters['cuisines'][value] += num
+            for value, num in cur.execute(
+                    "SELECT value, count(*) FROM {0} WHERE key = 'religion' GROUP BY value".format(table)):
+                counters['religions'][value] += num
+        return summary
+
+    def write_json(self, path=SUMMARY_PATH):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({category: dict(counter) for category, counter in self.counters.items()}, f)
+
+    @classmethod
+    def read_json(cls, path=SUMMARY_PATH):
+        summary = cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            for category, counter in json.load(f).items():
+                summary.counters[category].update(counter)
+        return summary
+
+
+# element type -> (table, tags table)
+STORED_TABLES = {
+    'node': ('nodes', 'nodes_tags'),
+    'way': ('ways', 'ways_tags'),
+    'relation': ('relations', 'relations_tags'),
+}
+
+
+def stored_element(cur, element_type, element_id):
+    """The stored attributes and tags of an element, shaped like shape_element() output"""
+    table, tags_table = STORED_TABLES[element_type]
+    row = cur.execute('SELECT user, uid FROM {0} WHERE id = ?'.format(table), (element_id,)).fetchone()
+    if row is None:
+        return None
+    tags = [{'key': key, 'value': value, 'type': tag_type} for key, value, tag_type in cur.execute(
+        'SELECT key, value, type FROM {0} WHERE id = ?'.format(tags_table), (element_id,))]
+    return {element_type: {'user': row[0], 'uid': row[1]}, element_type + '_tags': tags}
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Benchmark harness settings.
+ '''
+
+import json
+
+from benchmark import WAY_TAGS, compare, distribution, main, run_benchmark
+
+CAFES = [('amenity', 1.0, ['cafe'])]
+
+
+def test_tag_distribution_recorded_and_compared(capsys):
+    default = run_benchmark(nodes=400, ways=40, repeat=1, out=None)
+    cafes = run_benchmark(nodes=400, ways=40, repeat=1, out=None, node_tags=CAFES)
+    assert cafes['settings']['node_tags'] == distribution(CAFES)
+    assert cafes['settings']['way_tags'] == distribution(WAY_TAGS)
+    assert default['settings']['node_tags'] != cafes['settings']['node_tags']
+
+    capsys.readouterr()
+    compare(default, cafes)
+    assert 'settings differ: node_tags' in capsys.readouterr().out
+
+
+def test_cli_tags_file(tmp_path):
+    tags_path, out_path = tmp_path / 'tags.json', tmp_path / 'bench.json'
+    tags_path.write_text(json.dumps({'node_tags': CAFES}), encoding='utf-8')
+    assert main(['--nodes', '400', '--ways', '40', '--repeat', '1',
+                 '--tags', str(tags_path), '--out', str(out_path)]) == 0
+
+    with open(str(out_path), 'r', encoding='utf-8') as f:
+        settings = json.load(f)['settings']
+    assert settings['node_tags'] == distribution(CAFES)
+    assert settings['way_tags'] == distribution(WAY_TAGS)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ changes.apply_changes(): a small diff applied to a loaded database.
+ '''
+
+import sqlite3
+
+import pytest
+
+from changes import apply_changes
+from database import load_osm
+from queries import search_tags
+from summary import Summary
+
+ATTRIBUTES = 'version="2" changeset="99" timestamp="2018-01-01T00:00:00Z" uid="4242" user="differ"'
+
+# against a generate_osm(nodes=2000, ways=200) extract: ways n use nodes 8n-7 ... 8n
+DIFF = '''<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6">
+ <create>
+  <node id="5001" lat="41.9" lon="-87.7" {0}>
+   <tag k="amenity" v="cafe"/>
+   <tag k="name" v="Diffbrook Coffee"/>
+   <tag k="cuisine" v="coffee_shop"/>
+  </node>
+  <relation id="7001" {0}>
+   <member type="way" ref="1" role="route"/>
+   <member type="node" ref="5001" role="stop"/>
+   <tag k="type" v="route"/>
+   <tag k="name" v="Diffbrook Route"/>
+  </relation>
+ </create>
+ <modify>
+  <node id="1" lat="41.8" lon="-87.6" {0}>
+   <tag k="name" v="Diffbrook Library"/>
+   <tag k="addr:street" v="N Clark St"/>
+  </node>
+  <way id="1" {0}>
+   <nd ref="5001"/>
+   <nd ref="2"/>
+   <nd ref="1"/>
+   <tag k="highway" v="residential"/>
+   <tag k="name" v="Diffbrook Lane"/>
+  </way>
+ </modify>
+ <delete>
+  <way id="2" {0}/>
+  <node id="16" {0}/>
+ </delete>
+</osmChange>
+'''.format(ATTRIBUTES)
+
+
+@pytest.fixture
+def changed_db(sample_osm, tmp_path):
+    db_path = str(tmp_path / 'changes.db')
+    load_osm(sample_osm, db_path)
+    osc_path = str(tmp_path / 'diff.osc')
+    with open(osc_path, 'w', encoding='utf-8') as f:
+        f.write(DIFF)
+    counts = apply_changes(osc_path, db_path, validate=True)
+    assert counts == {('create', 'node'): 1, ('create', 'relation'): 1, ('modify', 'node'): 1,
+                      ('modify', 'way'): 1, ('delete', 'way'): 1, ('delete', 'node'): 1}
+    conn = sqlite3.connect(db_path)
+    yield conn
+    conn.close()
+
+
+def test_summary_matches_tables(changed_db):
+    cur = changed_db.cursor()
+    stored = Summary.load(cur)
+    assert stored.counters == Summary.from_db(cur).counters
+    assert stored.totals()['nodes'] == 2000
+    assert stored.totals()['ways'] == 199
+    assert stored.totals()['relations'] == 1
+    assert stored.counters['users']['differ'] == 3
+
+
+def test_changed_tags_in_all_tags_and_full_text(changed_db):
+    tags = changed_db.execute("SELECT element_type, id, key, value FROM all_tags WHERE value LIKE 'Diffbrook%'")
+    assert sorted(tags) == [('node', 1, 'name', 'Diffbrook Library'), ('node', 5001, 'name', 'Diffbrook Coffee'),
+                            ('relation', 7001, 'name', 'Diffbrook Route'), ('way', 1, 'name', 'Diffbrook Lane')]
+    assert sorted(search_tags(changed_db, '%iffbrook%')) == sorted(changed_db.execute(
+        "SELECT element_type, id, key, value, type FROM all_tags WHERE value LIKE '%iffbrook%'"))
+    assert changed_db.execute("SELECT value, type FROM all_tags WHERE element_type = 'node' AND id = 1 "
+                              "AND key = 'street'").fetchall() == [('North Clark St', 'addr')]
+
+    # every tag of the deleted and replaced elements is gone
+    assert not changed_db.execute("SELECT 1 FROM all_tags WHERE element_type = 'way' AND id = 2").fetchall()
+    assert not changed_db.execute("SELECT 1 FROM all_tags WHERE element_type = 'node' AND id = 16").fetchall()
+    assert changed_db.execute("SELECT count(*) FROM all_tags WHERE element_type = 'node' AND id = 1").fetchone() == (2,)
+
+
+def test_child_rows_and_spatial_index(changed_db):
+    assert changed_db.execute('SELECT node_id FROM ways_nodes WHERE id = 1 ORDER BY position').fetchall() == [
+        (5001,), (2,), (1,)]
+    assert not changed_db.execute('SELECT 1 FROM ways_nodes WHERE id = 2').fetchall()
+    assert not changed_db.execute('SELECT 1 FROM nodes WHERE id = 16').fetchall()
+    lats = [lat for lat, in changed_db.execute(
+        'SELECT lat FROM nodes WHERE id IN (SELECT node_id FROM ways_nodes WHERE id = 1)')]
+    min_lat, max_lat = changed_db.execute('SELECT min_lat, max_lat FROM ways_rtree WHERE id = 1').fetchone()
+    assert min_lat == pytest.approx(min(lats), abs=1e-5) and max_lat == pytest.approx(max(lats), abs=1e-5)
+    assert changed_db.execute('SELECT id FROM nodes_rtree WHERE id = 5001').fetchone() == (5001,)
+    assert not changed_db.execute('SELECT 1 FROM nodes_rtree WHERE id = 16').fetchall()
+    assert changed_db.execute('SELECT member_type, member_id, role FROM relations_members WHERE id = 7001 '
+                              'ORDER BY position').fetchall() == [('way', 1, 'route'), ('node', 5001, 'stop')]
+
+
+def test_integrity(changed_db):
+    assert changed_db.execute('PRAGMA integrity_check').fetchall() == [('ok',)]
+    changed_db.execute("INSERT INTO all_tags_fts (all_tags_fts) VALUES ('integrity-check')")
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Street name cleaning only touches the direction prefix and the street type.
+ '''
+
+import pytest
+
+from audit import update_type
+from cleaning import Cleaner, TokenRule, clean_value, mapping
+
+
+@pytest.mark.parametrize('value, cleaned', [
+    ('N Sangamon Street', 'North Sangamon Street'),  # already expanded: only the direction changes
+    ('Sangamon', 'Sangamon Street'),
+    ('West Madison Ave', 'West Madison Avenue'),
+    ('S Ave Maria Drive', 'South Ave Maria Drive'),  # 'Ave' is not the street type here
+    ('North Clark Street', 'North Clark Street'),
+])
+def test_clean_street(value, cleaned):
+    assert clean_value('addr:street', value) == cleaned
+
+
+@pytest.mark.parametrize('value, cleaned', [
+    ('N Sangamon Street', 'N Sangamon Street'),
+    ('Sangamon', 'Sangamon Street'),
+    ('West Madison Ave', 'West Madison Avenue'),
+    ('S Ave Maria Drive', 'S Ave Maria Drive'),
+])
+def test_update_type(value, cleaned):
+    assert update_type(value, mapping) == cleaned
+
+
+def test_token_positions():
+    cleaner = Cleaner({'k': [TokenRule('first', {'a': 'A'}, first_only=True),
+                             TokenRule('last', {'b': 'B'}, last_only=True),
+                             TokenRule('any', {'c': 'C'})]}, cache_size=0)
+    assert cleaner.clean('k', 'a b a c c b') == 'A b a C C B'
+    with pytest.raises(ValueError):
+        TokenRule('both', {}, first_only=True, last_only=True)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ coords.CoordinateStore lookups, with numpy and with the bisect fallback.
+ '''
+
+import csv
+import math
+import random
+
+import pytest
+
+import coords
+from coords import COORDS_PATH, CoordinateStore, CoordinateWriter, build_store, iter_way_coordinates
+from data import process_map
+
+
+@pytest.fixture(params=['numpy', 'no numpy'])
+def numpy(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(coords, 'np', None)
+    return request.param
+
+
+def points(result):
+    """lookup() rows as (lat, lon) tuples, None for ids the store lacks"""
+    return [None if math.isnan(lat) else (lat, lon) for lat, lon in (map(float, row) for row in result)]
+
+
+def write_store(path, shards):
+    """Store of the (id, lat, lon) rows of each shard"""
+    paths = []
+    for n, rows in enumerate(shards):
+        writer = CoordinateWriter('%s.%d' % (path, n))
+        for row in rows:
+            writer.add(*row)
+        writer.close()
+        paths.append(writer.path)
+    return build_store(paths, path)
+
+
+@pytest.mark.parametrize('shuffled', [False, True])
+def test_lookup(numpy, tmp_path, shuffled):
+    rng = random.Random(0)
+    nodes = {node_id: (rng.uniform(41, 42), rng.uniform(-88, -87)) for node_id in rng.sample(range(1, 10 ** 6), 500)}
+    rows = sorted((node_id, lat, lon) for node_id, (lat, lon) in nodes.items())
+    if shuffled:
+        rng.shuffle(rows)
+    path = str(tmp_path / 'coords.bin')
+    assert write_store(path, [rows[:200], rows[200:]]) == 500
+
+    wanted = rng.sample(sorted(nodes), 100) + [0, 10 ** 6, -5] + sorted(nodes)[:3]
+    store = CoordinateStore(path)
+    try:
+        assert len(store) == 500
+        assert points(store.lookup(wanted)) == [nodes.get(node_id) for node_id in wanted]
+        assert [store.get(node_id) for node_id in wanted] == [nodes.get(node_id) for node_id in wanted]
+        assert points(store.lookup([])) == []
+    finally:
+        store.close()
+
+
+def test_empty_store(numpy, tmp_path):
+    path = str(tmp_path / 'empty.bin')
+    assert write_store(path, [[]]) == 0
+    store = CoordinateStore(path)
+    try:
+        assert store.get(1) is None
+        assert points(store.lookup([1, 2])) == [None, None]
+    finally:
+        store.close()
+
+
+def test_iter_way_coordinates(numpy, sample_osm, workdir):
+    process_map(sample_osm, False)
+    with open('nodes.csv', 'r', encoding='utf-8', newline='') as f:
+        nodes = {int(row['id']): (float(row['lat']), float(row['lon'])) for row in csv.DictReader(f)}
+    ways = {}
+    with open('ways_nodes.csv', 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            ways.setdefault(int(row['id']), []).append((int(row['position']), int(row['node_id'])))
+
+    store = CoordinateStore(COORDS_PATH)
+    try:
+        found = {way_id: points(result) for way_id, result in iter_way_coordinates(store)}
+    finally:
+        store.close()
+    assert len(found) == 200
+    assert found == {way_id: [nodes[node_id] for _, node_id in sorted(way_nodes)]
+                     for way_id, way_nodes in ways.items()}
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ data.process_map(): parallel conversion and compressed input match the
+ serial output of the plain file.
+ '''
+
+import bz2
+import filecmp
+import gzip
+import os
+import shutil
+
+import pytest
+
+from coords import COORDS_PATH
+from data import OUTPUTS, process_map, split_osm
+from summary import SUMMARY_PATH
+
+OUTPUT_FILES = [path for _, path, _ in OUTPUTS] + [SUMMARY_PATH, COORDS_PATH]
+
+
+def run(osm_path, directory, workers):
+    os.makedirs(directory)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        process_map(osm_path, True, workers=workers)
+    finally:
+        os.chdir(cwd)
+
+
+def assert_same_outputs(expected, actual):
+    for name in OUTPUT_FILES:
+        assert filecmp.cmp(os.path.join(expected, name), os.path.join(actual, name), shallow=False), name
+
+
+@pytest.mark.parametrize('workers', [2, 3, 8])
+def test_parallel_matches_serial(make_osm, tmp_path, workers):
+    osm_path = make_osm(nodes=3000, ways=300)
+    run(osm_path, str(tmp_path / 'serial'), 1)
+    run(osm_path, str(tmp_path / 'parallel'), workers)
+    assert_same_outputs(str(tmp_path / 'serial'), str(tmp_path / 'parallel'))
+
+
+def test_more_workers_than_elements(make_osm, tmp_path):
+    osm_path = make_osm(nodes=8, ways=1)
+    assert len(split_osm(osm_path, 40)) <= 9
+    run(osm_path, str(tmp_path / 'serial'), 1)
+    run(osm_path, str(tmp_path / 'parallel'), 10)
+    assert_same_outputs(str(tmp_path / 'serial'), str(tmp_path / 'parallel'))
+
+
+def test_split_needs_closing_root(make_osm):
+    osm_path = make_osm(nodes=100, ways=10)
+    with open(osm_path, 'rb') as f:
+        data = f.read()
+    with open(osm_path, 'wb') as f:
+        f.write(data[:data.rindex(b'</osm>')])
+    with pytest.raises(ValueError, match='closing </osm>'):
+        split_osm(osm_path, 4)
+
+
+@pytest.mark.parametrize('suffix, opener', [('.gz', gzip.open), ('.bz2', bz2.open)], ids=['gzip', 'bz2'])
+def test_compressed_matches_plain(make_osm, tmp_path, suffix, opener):
+    osm_path = make_osm(nodes=2000, ways=200)
+    with open(osm_path, 'rb') as f, opener(osm_path + suffix, 'wb') as out:
+        shutil.copyfileobj(f, out)
+    run(osm_path, str(tmp_path / 'plain'), 1)
+    run(osm_path + suffix, str(tmp_path / 'compressed'), 1)
+    assert_same_outputs(str(tmp_path / 'plain'), str(tmp_path / 'compressed'))
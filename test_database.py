@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ database.load_osm() / load_csv() / finish_load(): relations, reloading an
+ existing database, and the summary load_csv() stores.
+ '''
+
+import shutil
+import sqlite3
+
+import database
+from data import process_map, shape_element
+from queries import has_full_text, search_tags
+from stream import get_element
+from summary import SUMMARY_PATH, Summary
+
+PATTERNS = ['%Clark%', 'Jewel%', '%cafe%', '%8%']
+
+ATTRIBUTES = 'version="1" changeset="5" timestamp="2017-06-20T12:00:00Z"'
+
+RELATIONS = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+ <node id="1" lat="41.88" lon="-87.63" uid="1" user="ann" {0}><tag k="amenity" v="cafe"/></node>
+ <node id="2" lat="41.89" lon="-87.62" uid="2" user="ben" {0}/>
+ <way id="10" uid="1" user="ann" {0}><nd ref="1"/><nd ref="2"/><tag k="building" v="church"/></way>
+ <relation id="100" uid="3" user="cat" {0}>
+  <member type="way" ref="10" role="outer"/>
+  <member type="node" ref="2" role="entrance"/>
+  <member type="relation" ref="101" role=""/>
+  <tag k="type" v="multipolygon"/>
+  <tag k="religion" v="christian"/>
+  <tag k="name" v="Relbrook Chapel"/>
+ </relation>
+ <relation id="101" uid="3" user="cat" {0}>
+  <member type="node" ref="1" role="stop"/>
+  <tag k="cuisine" v="pizza"/>
+ </relation>
+</osm>
+'''.format(ATTRIBUTES)
+
+
+def like_rows(conn, pattern):
+    return sorted(conn.execute("SELECT element_type, id, key, value, type FROM all_tags WHERE value LIKE ?",
+                               (pattern,)))
+
+
+def test_reload_without_full_text_drops_the_index(make_osm, tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'reload.db')
+    database.load_osm(make_osm('first.osm', nodes=500, ways=50), db_path)
+    with sqlite3.connect(db_path) as conn:
+        assert has_full_text(conn)
+
+    monkeypatch.setattr(database, 'FULL_TEXT', False)
+    database.load_osm(make_osm('second.osm', nodes=2000, ways=200, seed=1), db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        assert not has_full_text(conn)
+        assert conn.execute('PRAGMA integrity_check').fetchall() == [('ok',)]
+        for pattern in PATTERNS:
+            assert sorted(search_tags(conn, pattern)) == like_rows(conn, pattern), pattern
+        assert like_rows(conn, '%')
+    finally:
+        conn.close()
+
+
+
+def load_csv_summaries():
+    """The summary load_csv() stored, and the one aggregated from the loaded tables"""
+    database.load_csv('csv.db')
+    with sqlite3.connect('csv.db') as conn:
+        cur = conn.cursor()
+        return Summary.load(cur).counters, Summary.from_db(cur).counters
+
+
+def test_load_csv_checks_the_summary_against_the_csvs(make_osm, workdir):
+    process_map(make_osm('other.osm', nodes=500, ways=50, seed=1), False)
+    shutil.copy(SUMMARY_PATH, 'other.json')
+    process_map(make_osm(nodes=2000, ways=200), False)
+    stored, aggregated = load_csv_summaries()
+    assert stored == aggregated
+    assert stored == Summary.read_json(SUMMARY_PATH).counters
+
+    # a summary.json left over from another extract
+    shutil.copy('other.json', SUMMARY_PATH)
+    stored, aggregated = load_csv_summaries()
+    assert stored == aggregated
+    assert stored['elements']['node'] == 2000
+
+
+def test_relations(tmp_path):
+    osm_path, db_path = str(tmp_path / 'relations.osm'), str(tmp_path / 'relations.db')
+    with open(osm_path, 'w', encoding='utf-8') as f:
+        f.write(RELATIONS)
+
+    shaped = shape_element(next(iter(get_element(osm_path, tags=('relation',)))))
+    assert shaped['relation']['id'] == '100' and shaped['relation']['user'] == 'cat'
+    assert [(m['member_type'], m['member_id'], m['role'], m['position']) for m in shaped['relation_members']] == [
+        ('way', '10', 'outer', 0), ('node', '2', 'entrance', 1), ('relation', '101', '', 2)]
+    assert [(t['key'], t['value']) for t in shaped['relation_tags']] == [
+        ('type', 'multipolygon'), ('religion', 'christian'), ('name', 'Relbrook Chapel')]
+
+    database.load_osm(osm_path, db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute('SELECT id, user, uid FROM relations ORDER BY id').fetchall() == [
+            (100, 'cat', 3), (101, 'cat', 3)]
+        assert conn.execute('SELECT id, member_type, member_id, role FROM relations_members '
+                            'ORDER BY id, position').fetchall() == [
+            (100, 'way', 10, 'outer'), (100, 'node', 2, 'entrance'), (100, 'relation', 101, ''),
+            (101, 'node', 1, 'stop')]
+        assert conn.execute('SELECT count(*) FROM relations_tags').fetchone() == (4,)
+        assert sorted(conn.execute("SELECT id, key, value FROM all_tags WHERE element_type = 'relation'")) == [
+            (100, 'name', 'Relbrook Chapel'), (100, 'religion', 'christian'), (100, 'type', 'multipolygon'),
+            (101, 'cuisine', 'pizza')]
+        assert search_tags(conn, '%elbrook%') == [('relation', 100, 'name', 'Relbrook Chapel', 'regular')]
+
+        cur = conn.cursor()
+        stored = Summary.load(cur)
+        assert stored.totals() == {'nodes': 2, 'ways': 1, 'relations': 2, 'unique_users': 2}
+        assert stored.counters['religions'] == {'christian': 1}
+        assert stored.counters['cuisines'] == {'pizza': 1}
+        assert stored.counters == Summary.from_db(cur).counters
+    finally:
+        conn.close()
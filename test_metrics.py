@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Stage counts reported by metrics.Metrics.
+ '''
+
+import pytest
+
+from data import process_map
+from metrics import Metrics
+from validator import ValidationPolicy
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_validate_stage_counts_only_validated_elements(sample_osm, workdir, workers):
+    metrics = Metrics()
+    result = process_map(sample_osm, ValidationPolicy(every=10), workers=workers, metrics=metrics)
+    stages = metrics.as_dict()['stages']
+    validated = sum(result['validation']['validated'].values())
+    assert stages['shape']['elements'] == 2200
+    assert 0 < validated < 2200
+    assert stages['validate']['elements'] == validated
+
+    metrics = Metrics()
+    process_map(sample_osm, True, workers=workers, metrics=metrics)
+    assert metrics.as_dict()['stages']['validate']['elements'] == 2200
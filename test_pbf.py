@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ pbf.pbf_elements() on a small hand-built PBF file.
+ '''
+
+import struct
+import zlib
+
+import pytest
+
+from pbf import pbf_elements
+
+# 2017-06-20T12:00:00Z
+STAMP = 1497960000
+
+
+# ### A minimal protobuf writer
+
+def varint(n):
+    out = bytearray()
+    while True:
+        b, n = n & 0x7f, n >> 7
+        if not n:
+            out.append(b)
+            return bytes(out)
+        out.append(b | 0x80)
+
+
+def zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def number(field, n):
+    return varint(field << 3) + varint(n)
+
+
+def message(field, data):
+    return varint(field << 3 | 2) + varint(len(data)) + data
+
+
+def packed(field, values, sint=False):
+    return message(field, b''.join(varint(zigzag(v) if sint else v) for v in values))
+
+
+def deltas(values):
+    return [b - a for a, b in zip([0] + values, values)]
+
+
+def blob(blob_type, data, compress=True):
+    body = number(2, len(data)) + message(3, zlib.compress(data)) if compress else message(1, data)
+    header = message(1, blob_type.encode('utf-8')) + number(3, len(body))
+    return struct.pack('>I', len(header)) + header + body
+
+
+STRINGS = ['', 'amenity', 'cafe', 'name', 'Hub', 'alice', 'bob', 'highway', 'residential', 'outer', 'type',
+           'multipolygon', 'inner']
+
+
+def info(version, changeset, uid, user):
+    return message(4, number(1, version) + number(2, STAMP) + number(3, changeset) + number(4, uid)
+                   + number(5, STRINGS.index(user)))
+
+
+def primitive_block():
+    s = STRINGS.index
+    dense = (packed(1, deltas([10, 11, 12]), sint=True)
+             + message(5, packed(1, [1, 2, 3]) + packed(2, deltas([STAMP] * 3), sint=True)
+                       + packed(3, deltas([500, 501, 500]), sint=True) + packed(4, deltas([7, 8, 7]), sint=True)
+                       + packed(5, deltas([s('alice'), s('bob'), s('alice')]), sint=True))
+             + packed(8, deltas([418781136, 418781200, 418700000]), sint=True)
+             + packed(9, deltas([-876297982, -876297000, -876300000]), sint=True)
+             # node 10: amenity=cafe, name=Hub; node 11: none; node 12: amenity=cafe
+             + packed(10, [s('amenity'), s('cafe'), s('name'), s('Hub'), 0, 0, s('amenity'), s('cafe'), 0]))
+    way = (number(1, 20) + packed(2, [s('highway')]) + packed(3, [s('residential')]) + info(4, 600, 8, 'bob')
+           + packed(8, deltas([12, 10, 11, 12]), sint=True))
+    relation = (number(1, 30) + packed(2, [s('type')]) + packed(3, [s('multipolygon')])
+                + info(2, 700, 7, 'alice') + packed(8, [s('outer'), s('inner'), 0])
+                + packed(9, deltas([20, 10, 30]), sint=True) + packed(10, [1, 0, 2]))
+    strings = message(1, b''.join(message(1, string.encode('utf-8')) for string in STRINGS))
+    return (strings + message(2, message(2, dense)) + message(2, message(3, way))
+            + message(2, message(4, relation)))
+
+
+def attributes(version, changeset, uid, user):
+    return {'version': str(version), 'timestamp': '2017-06-20T12:00:00Z', 'changeset': str(changeset),
+            'uid': str(uid), 'user': user}
+
+
+def tag(k, v):
+    return ('tag', {'k': k, 'v': v})
+
+
+EXPECTED = [
+    ('node', dict(attributes(1, 500, 7, 'alice'), id='10', lat='41.8781136', lon='-87.6297982'),
+     [tag('amenity', 'cafe'), tag('name', 'Hub')]),
+    ('node', dict(attributes(2, 501, 8, 'bob'), id='11', lat='41.87812', lon='-87.6297'), []),
+    ('node', dict(attributes(3, 500, 7, 'alice'), id='12', lat='41.87', lon='-87.63'), [tag('amenity', 'cafe')]),
+    ('way', dict(attributes(4, 600, 8, 'bob'), id='20'),
+     [('nd', {'ref': ref}) for ref in ('12', '10', '11', '12')] + [tag('highway', 'residential')]),
+    ('relation', dict(attributes(2, 700, 7, 'alice'), id='30'),
+     [('member', {'type': 'way', 'ref': '20', 'role': 'outer'}),
+      ('member', {'type': 'node', 'ref': '10', 'role': 'inner'}),
+      ('member', {'type': 'relation', 'ref': '30', 'role': ''}),
+      tag('type', 'multipolygon')]),
+]
+
+
+@pytest.mark.parametrize('compress', [True, False], ids=['zlib', 'raw'])
+def test_hand_built_block(tmp_path, compress):
+    path = str(tmp_path / 'block.osm.pbf')
+    header = message(4, b'OsmSchema-V0.6') + message(4, b'DenseNodes')
+    with open(path, 'wb') as f:
+        f.write(blob('OSMHeader', header, compress) + blob('OSMData', primitive_block(), compress))
+
+    records = [(record.tag, record.attrib, [(child.tag, child.attrib) for child in record])
+               for record in pbf_elements(path)]
+    assert records == EXPECTED
+    assert [record.tag for record in pbf_elements(path, tags=('way',))] == ['way']
+
+
+def test_unsupported_feature(tmp_path):
+    path = str(tmp_path / 'historical.osm.pbf')
+    with open(path, 'wb') as f:
+        f.write(blob('OSMHeader', message(4, b'OsmSchema-V0.6') + message(4, b'HistoricalInformation')))
+    with pytest.raises(ValueError, match='HistoricalInformation'):
+        list(pbf_elements(path))
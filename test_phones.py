@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Phone backfill of an already loaded database.
+ '''
+
+import sqlite3
+
+from database import load_osm
+from phones import backfill_sqlite
+from queries import QUERIES
+
+RAW_PHONE = '(312) 920-9100'
+E164_PHONE = '+13129209100'
+
+
+def test_backfill_updates_all_tags_and_full_text(sample_osm, tmp_path):
+    db_path = str(tmp_path / 'phones.db')
+    load_osm(sample_osm, db_path)
+
+    # phone values as loaded before cleaning normalized them
+    conn = sqlite3.connect(db_path)
+    for table in ('nodes_tags', 'all_tags'):
+        conn.execute("UPDATE {0} SET value = ? WHERE key = 'phone'".format(table), (RAW_PHONE,))
+    conn.commit()
+    phones = conn.execute("SELECT count(*) FROM nodes_tags WHERE key = 'phone'").fetchone()[0]
+    conn.close()
+    assert phones
+
+    changed = backfill_sqlite(db_path)
+    assert changed['nodes_tags'] == changed['all_tags'] == phones
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert {row[0] for row in conn.execute(QUERIES['phones'])} == {E164_PHONE}
+        assert conn.execute('SELECT count(*) FROM all_tags_fts WHERE value LIKE ?',
+                            ('%' + RAW_PHONE + '%',)).fetchone()[0] == 0
+        assert conn.execute('SELECT count(*) FROM all_tags_fts WHERE value LIKE ?',
+                            ('%' + E164_PHONE + '%',)).fetchone()[0] == phones
+    finally:
+        conn.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ queries.query(): cached results are dropped when the database changes;
+ tags_in_box() / tags_near() against a brute-force scan.
+ '''
+
+import os
+import random
+import shutil
+import sqlite3
+
+import pytest
+
+import queries
+from benchmark import CHICAGO_BBOX
+from database import load_osm
+
+
+@pytest.fixture
+def db_path(sample_osm, tmp_path):
+    path = str(tmp_path / 'queries.db')
+    load_osm(sample_osm, path)
+    yield path
+    queries.close_connections()
+    queries.clear_cache()
+
+
+def node_tags(db_path):
+    return queries.query('element_tags', db_path, element_type='node', id=1)
+
+
+def test_cache_invalidated_by_a_write(db_path):
+    before = node_tags(db_path)
+    assert node_tags(db_path) is before
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO all_tags (element_type, id, key, value, type) "
+                     "VALUES ('node', 1, 'note', 'written', 'regular')")
+    after = node_tags(db_path)
+    assert after == before + (('note', 'written', 'regular'),)
+    assert node_tags(db_path) is after
+
+
+def test_cache_invalidated_by_a_replaced_file(db_path, tmp_path):
+    before = node_tags(db_path)
+    conn, _ = queries.connect(db_path)
+
+    # same size and mtime: only the inode tells the files apart
+    replacement = str(tmp_path / 'replacement.db')
+    shutil.copy(db_path, replacement)
+    with sqlite3.connect(replacement) as new:
+        new.execute("INSERT INTO all_tags (element_type, id, key, value, type) "
+                    "VALUES ('node', 1, 'note', 'replaced', 'regular')")
+    new.close()
+    st = os.stat(db_path)
+    assert os.path.getsize(replacement) == st.st_size
+    os.utime(replacement, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(replacement, db_path)
+
+    assert queries.generation(db_path)[1:] == (st.st_size, st.st_mtime_ns)
+    assert node_tags(db_path) == before + (('note', 'replaced', 'regular'),)
+    assert queries.connect(db_path)[0] is not conn
+
+
+def brute_force_boxes(db_path):
+    """{(element_type, id): (min_lat, max_lat, min_lon, max_lon)} without the R*Tree"""
+    with sqlite3.connect(db_path) as conn:
+        boxes = {('node', i): (lat, lat, lon, lon) for i, lat, lon in conn.execute('SELECT id, lat, lon FROM nodes')}
+        boxes.update((('way', i), box) for i, *box in conn.execute(
+            'SELECT w.id, min(n.lat), max(n.lat), min(n.lon), max(n.lon) '
+            'FROM ways_nodes w JOIN nodes n ON n.id = w.node_id GROUP BY w.id'))
+        tags = {}
+        for element_type, i, k, v in conn.execute('SELECT element_type, id, key, value FROM all_tags'):
+            tags.setdefault((element_type, i), []).append((k, v))
+    conn.close()
+    return boxes, tags
+
+
+def random_boxes(n=20, seed=0):
+    rng = random.Random(seed)
+    min_lat, min_lon, max_lat, max_lon = CHICAGO_BBOX
+    for _ in range(n):
+        lat, lon = rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+        yield lat, lon, rng.uniform(0.005, 0.05)
+
+
+@pytest.mark.parametrize('key', [None, 'amenity', 'highway'])
+def test_tags_in_box_matches_brute_force(db_path, key):
+    boxes, tags = brute_force_boxes(db_path)
+    for lat, lon, size in random_boxes():
+        expected = sorted((element_type, i, k, v)
+                          for (element_type, i), (lo_lat, hi_lat, lo_lon, hi_lon) in boxes.items()
+                          if hi_lat >= lat and lo_lat <= lat + size and hi_lon >= lon and lo_lon <= lon + size
+                          for k, v in tags.get((element_type, i), ()) if key in (None, k))
+        rows = queries.tags_in_box(lat, lon, lat + size, lon + size, key=key, db_path=db_path)
+        assert sorted(row[:4] for row in rows) == expected
+
+
+@pytest.mark.parametrize('key', [None, 'amenity'])
+def test_tags_near_matches_brute_force(db_path, key):
+    boxes, tags = brute_force_boxes(db_path)
+    for lat, lon, size in random_boxes(seed=1):
+        radius = size * 50000
+        expected = []
+        for (element_type, i), (lo_lat, hi_lat, lo_lon, hi_lon) in boxes.items():
+            d = queries.distance(lat, lon, min(max(lat, lo_lat), hi_lat), min(max(lon, lo_lon), hi_lon))
+            if d <= radius:
+                expected.extend((d, element_type, i, k, v) for k, v in tags.get((element_type, i), ())
+                                if key in (None, k))
+        rows = queries.tags_near(lat, lon, radius, key=key, db_path=db_path)
+        assert [row[0] for row in rows] == sorted(row[0] for row in rows)
+        # ways_rtree keeps 32-bit boxes, rounded outwards: about a metre at Chicago's longitude
+        found = {row[1:]: row[0] for row in rows}
+        assert sorted(found) == sorted(row[1:] for row in expected)
+        assert [found[row[1:]] for row in expected] == pytest.approx([row[0] for row in expected], abs=2)
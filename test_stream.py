@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Streaming keeps memory flat: parsing and auditing a file ten times larger
+ must not need more memory.
+ '''
+
+import tracemalloc
+
+import pytest
+
+from audit import audit_all
+from stream import iter_elements
+
+NODES = 5000
+
+# peak traced memory of the 10x file may exceed the small file's by this much
+SLACK = 0.25
+
+
+def peak_memory(function, *args):
+    """Peak traced memory in bytes while function(*args) runs"""
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def drain(osm_file):
+    for _ in iter_elements(osm_file):
+        pass
+
+
+@pytest.mark.parametrize('function', [drain, audit_all], ids=['iter_elements', 'audit_all'])
+def test_memory_flat_as_input_grows(make_osm, function):
+    small = make_osm('small.osm', nodes=NODES, ways=NODES // 10)
+    large = make_osm('large.osm', nodes=NODES * 10, ways=NODES)
+    function(small)  # warm up imports, regex and cleaning caches
+    small_peak = peak_memory(function, small)
+    large_peak = peak_memory(function, large)
+    assert large_peak <= small_peak * (1 + SLACK), (small_peak, large_peak)
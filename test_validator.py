@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ The compiled validator.Validator gives the same answers and errors as
+ cerberus on shaped elements; ValidationPolicy sampling.
+ '''
+
+import copy
+
+import pytest
+
+from Schema import schema
+from data import shape_element
+from stream import get_element
+from validator import ValidationPolicy, Validator
+
+
+def breakages():
+    """(name, function breaking a shaped element in place) pairs"""
+    def drop(key, field):
+        return lambda el: el[key].pop(field, None) if key in el else None
+
+    def set_value(key, field, value):
+        def apply(el):
+            if key in el:
+                el[key][field] = value
+        return apply
+
+    def set_child(key, field, value):
+        def apply(el):
+            if el.get(key):
+                el[key][0][field] = value
+        return apply
+
+    return [
+        ('valid', lambda el: None),
+        ('missing uid', drop('node', 'uid')),
+        ('bad lat', set_value('node', 'lat', 'abc')),
+        ('none changeset', set_value('way', 'changeset', None)),
+        ('unknown field', set_value('way', 'colour', 'red')),
+        ('int user', set_value('node', 'user', 7)),
+        ('bad tag id', set_child('node_tags', 'id', 'x')),
+        ('bad position', set_child('way_nodes', 'position', 'first')),
+        ('tags not a list', lambda el: el.update(node_tags='none') if 'node_tags' in el else None),
+        ('bad member type', set_child('relation_members', 'member_type', 'area')),
+        ('unknown element', lambda el: el.update(area={})),
+    ]
+
+
+@pytest.fixture
+def shaped(make_osm):
+    osm_path = make_osm(nodes=100, ways=10)
+    elements = [shape_element(element) for element in get_element(osm_path, tags=('node', 'way'))]
+    elements.append({
+        'relation': {'id': '1', 'user': 'u', 'uid': '2', 'version': '1', 'changeset': '3',
+                     'timestamp': '2017-01-01T00:00:00Z'},
+        'relation_members': [{'id': '1', 'member_type': 'way', 'member_id': '4', 'role': 'outer',
+                              'position': 0}],
+        'relation_tags': [{'id': '1', 'key': 'type', 'value': 'multipolygon', 'type': 'regular'}],
+    })
+    return elements
+
+
+@pytest.mark.parametrize('name, breakage', breakages(), ids=[name for name, _ in breakages()])
+def test_same_errors_as_cerberus(shaped, name, breakage):
+    cerberus = pytest.importorskip('cerberus')
+    validator = Validator()
+    reference = cerberus.Validator()
+    for element in shaped:
+        element = copy.deepcopy(element)
+        breakage(element)
+        assert validator.validate(element, schema) == reference.validate(element, schema), element
+        assert validator.errors == reference.errors, element
+
+
+def sample(policy, n=1000):
+    return [policy.selects('node') for _ in range(n)]
+
+
+def test_for_chunk_reseeds_a_fresh_policy():
+    policy = ValidationPolicy(rate=0.3, first=2, seed=7, max_examples=3)
+    sample(policy)
+    chunk = policy.for_chunk(1)
+    assert (chunk.rate, chunk.first, chunk.seed, chunk.max_examples) == (0.3, 2, 7, 3)
+    assert not chunk.seen
+
+    assert sample(policy.for_chunk(1)) == sample(policy.for_chunk(1))
+    assert sample(policy.for_chunk(1)) != sample(policy.for_chunk(2))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+ Compiled validation for the shaped OSM elements.
+
+ cerberus walks the schema and normalizes a copy of the document for every
+ element it validates.  compile_schema() walks the schema in Schema.py once
+ and builds one closure per field that does the coercion and type checks
+ directly.  Validator is a drop-in replacement for cerberus.Validator as
+ used by data.validate_element(): validate(document, schema) returns a bool
+ and errors holds the same nested error dict, with the same messages and
+ ordering, that cerberus would produce.  The document itself is never
+ modified; coerced values are only used for the type checks.
+
+ ValidationPolicy validates a sample of the elements instead of all of
+ them and aggregates the failures into a summary rather than raising on the
+ first bad element.
+ '''
+
+import random
+from collections import Counter
+from collections.abc import Mapping, Sequence
+
+REQUIRED_FIELD = 'required field'
+UNKNOWN_FIELD = 'unknown field'
+NOT_NULLABLE = 'null value not allowed'
+BAD_TYPE = 'must be of {0} type'
+UNALLOWED_VALUE = 'unallowed value {0}'
+COERCION_FAILED = "field '{0}' cannot be coerced: {1}"
+
+
+def _is_list(value):
+    return isinstance(value, Sequence) and not isinstance(value, (str, bytes))
+
+
+TYPE_CHECKS = {
+    'integer': lambda value: isinstance(value, int),
+    'float': lambda value: isinstance(value, (float, int)),
+    'string': lambda value: isinstance(value, str),
+    'dict': lambda value: isinstance(value, Mapping),
+    'list': _is_list,
+}
+
+
+def _sorted(errors):
+    """cerberus reports the fields of a mapping in sorted order"""
+    return dict(sorted(errors.items())) if len(errors) > 1 else errors
+
+
+def compile_field(field, rules):
+    """Return check(value) -> list of error messages for one field"""
+    type_name = rules['type']
+    is_type = TYPE_CHECKS[type_name]
+    bad_type = BAD_TYPE.format(type_name)
+    coerce = rules.get('coerce')
+    allowed = frozenset(rules['allowed']) if 'allowed' in rules else None
+
+    nested = None
+    if 'schema' in rules:
+        if type_name == 'dict':
+            nested = compile_mapping(rules['schema'])
+        else:
+            nested = compile_items(rules['schema'])
+
+    def check(value):
+        errors = []
+        if coerce is not None:
+            try:
+                value = coerce(value)
+            except Exception as e:
+                errors.append(COERCION_FAILED.format(field, e))
+
+        if value is None:
+            errors.insert(0, NOT_NULLABLE)
+        elif not is_type(value):
+            errors.insert(0, bad_type)
+        elif allowed is not None and value not in allowed:
+            errors.append(UNALLOWED_VALUE.format(value))
+        elif nested is not None:
+            nested_errors = nested(value)
+            if nested_errors:
+                errors.append(nested_errors)
+        return errors
+
+    return check
+
+
+def compile_mapping(fields):
+    """Return check(mapping) -> {field: errors} for a dict schema"""
+    checks = {field: compile_field(field, rules) for field, rules in fields.items()}
+    required = [field for field, rules in fields.items() if rules.get('required')]
+
+    def check(document):
+        errors = {}
+        for field, value in document.items():
+            field_check = checks.get(field)
+            if field_check is None:
+                errors[field] = [UNKNOWN_FIELD]
+                continue
+            field_errors = field_check(value)
+            if field_errors:
+                errors[field] = field_errors
+
+        for field in required:
+            if field not in document:
+                errors[field] = [REQUIRED_FIELD]
+        return _sorted(errors)
+
+    return check
+
+
+def compile_items(rules):
+    """Return check(list) -> {index: errors} for the items of a list schema"""
+    item_check = compile_field(None, rules)
+
+    def check(items):
+        errors = {}
+        for index, item in enumerate(items):
+            item_errors = item_check(item)
+            if item_errors:
+                errors[index] = item_errors
+        return errors
+
+    return check
+
+
+def compile_schema(schema):
+    """Compile a cerberus style schema into check(document) -> errors dict"""
+    return compile_mapping(schema)
+
+
+class Validator(object):
+    """Validate documents against schemas compiled once with compile_schema()"""
+
+    def __init__(self):
+        self._compiled = {}
+        self.errors = {}
+
+    def validate(self, document, schema):
+        key = id(schema)
+        compiled = self._compiled.get(key)
+        if compiled is None or compiled[0] is not schema:
+            compiled = self._compiled[key] = (schema, compile_schema(schema))
+
+        self.errors = compiled[1](document)
+        return not self.errors
+
+
+def error_paths(errors, prefix=''):
+    """Yield (dotted field path, message) for every message in a nested errors dict"""
+    for field, messages in errors.items():
+        path = prefix if isinstance(field, int) else (prefix + '.' + field if prefix else field)
+        for message in messages:
+            if isinstance(message, dict):
+                for item in error_paths(message, path):
+                    yield item
+            else:
+                yield path, message
+
+
+class ValidationPolicy(object):
+    """Choose which shaped elements to validate and summarize the failures
+
+    every: validate every Nth element of each type
+    rate: validate each element with this probability
+    first: validate the first K elements of each type
+    until_clean: validate every element of a type until this many in a row
+        have passed, then stop validating that type
+    An element is validated when any of the given options selects it; with
+    no options every element is validated.  Failures never raise, they are
+    counted per element type and per field, with up to max_examples kept.
+    """
+
+    def __init__(self, every=None, rate=None, first=None, until_clean=None,
+                 seed=None, max_examples=10):
+        self.every = every
+        self.rate = rate
+        self.first = first
+        self.until_clean = until_clean
+        self.max_examples = max_examples
+        self.seed = seed
+        self._random = random.Random(seed)
+
+        self.seen = Counter()
+        self.validated = Counter()
+        self.failed = Counter()
+        self.field_errors = Counter()
+        self.examples = []
+        self._clean_streak = Counter()
+        self._clean_types = set()
+
+    def selects(self, element_type):
+        """Count one element of element_type and decide whether to validate it"""
+        n = self.seen[element_type]
+        self.seen[element_type] += 1
+
+        if self.every is None and self.rate is None and self.first is None and self.until_clean is None:
+            return True
+        if self.every is not None and n % self.every == 0:
+            return True
+        if self.first is not None and n < self.first:
+            return True
+        if self.until_clean is not None and element_type not in self._clean_types:
+            return True
+        if self.rate is not None and self._random.random() < self.rate:
+            return True
+        return False
+
+    def check(self, element, validator, schema):
+        """Validate a shaped element if the policy selects it; return False if it failed"""
+        element_type = next(iter(element))
+        if not self.selects(element_type):
+            return True
+        return self.validate(element, validator, schema)
+
+    def validate(self, element, validator, schema):
+        """Validate a shaped element selects() chose; return False if it failed"""
+        element_type = next(iter(element))
+        self.validated[element_type] += 1
+        if validator.validate(element, schema):
+            self._clean_streak[element_type] += 1
+            if self.until_clean is not None and self._clean_streak[element_type] >= self.until_clean:
+                self._clean_types.add(element_type)
+            return True
+
+        self._clean_streak[element_type] = 0
+        self.failed[element_type] += 1
+        for path, message in error_paths(validator.errors):
+            self.field_errors[(path, message)] += 1
+        if len(self.examples) < self.max_examples:
+            self.examples.append({
+                'type': element_type,
+                'id': element[element_type].get('id') if isinstance(element[element_type], Mapping) else None,
+                'errors': validator.errors,
+            })
+        return False
+
+    def for_chunk(self, n):
+        """A fresh policy with these options for chunk n of a parallel run
+
+        Random sampling is seeded from seed and n, so each chunk draws its own
+        reproducible sample (an unseeded policy stays unseeded).
+        """
+        policy = ValidationPolicy(self.every, self.rate, self.first, self.until_clean,
+                                  self.seed, self.max_examples)
+        policy._random.seed(None if self.seed is None else self.seed * 1000003 + n)
+        return policy
+
+    def merge(self, other):
+        """Fold the counts and examples of another policy (e.g. a worker's) into this one"""
+        self.seen.update(other.seen)
+        self.validated.update(other.validated)
+        self.failed.update(other.failed)
+        self.field_errors.update(other.field_errors)
+        self.examples.extend(other.examples[:max(0, self.max_examples - len(self.examples))])
+        return self
+
+    def summary(self):
+        return {
+            'seen': dict(self.seen),
+            'validated': dict(self.validated),
+            'failed': dict(self.failed),
+            'errors': [{'field': path, 'message': message, 'count': count}
+                       for (path, message), count in self.field_errors.most_common()],
+            'examples': self.examples,
+        }